@@ -3,38 +3,52 @@
 import asyncio
 import json
 import logging
+import orjson
 import shlex
 import shutil
-from typing import Optional, AsyncIterator
+from dataclasses import dataclass, field
+from typing import Callable, Optional, AsyncIterator
 from pathlib import Path
 
 from .config import get_config
 from .acp_protocol import (
     parse_frame,
+    peek_method,
     classify_frame,
     is_thinking_content,
     get_update_segment_kind,
+    get_block_segment_kind,
     TurnState,
     THINKING_KINDS,
 )
 
 logger = logging.getLogger(__name__)
 
+# Largest single JSON-RPC line we accept from the agent. asyncio's default
+# StreamReader limit (64 KiB) is too small for frames with inline media.
+AGENT_READ_LIMIT = 32 * 1024 * 1024
 
+# Longest silence tolerated between agent frames during a request
+AGENT_READ_TIMEOUT = 300.0
+
+# asyncio.timeout() (3.11+) cancels in place; wait_for wraps the read in a Task
+_HAS_ASYNCIO_TIMEOUT = hasattr(asyncio, "timeout")
+
+
+@dataclass
 class _ACPState:
     """Encapsulated ACP client state."""
 
-    def __init__(self) -> None:
-        self.agent_proc = None
-        self.agent_reader = None
-        self.agent_writer = None
-        self.agent_lock = asyncio.Lock()
-        self.request_lock = asyncio.Lock()  # Ensures only one request at a time
-        self.session_id = None
-        self.request_id = 0
-        self.pending_requests = {}  # request_id -> asyncio.Future
-        self.request_callback = None  # Callback to notify UI of pending requests
-        self.whitelist_checker = None  # Callback to check if request is whitelisted
+    agent_proc: Optional[asyncio.subprocess.Process] = None
+    agent_reader: Optional[asyncio.StreamReader] = None
+    agent_writer: Optional[asyncio.StreamWriter] = None
+    agent_lock: asyncio.Lock = field(default_factory=asyncio.Lock)
+    request_lock: asyncio.Lock = field(default_factory=asyncio.Lock)  # Ensures only one request at a time
+    session_id: Optional[str] = None
+    request_id: int = 0
+    pending_requests: dict = field(default_factory=dict)  # request_id -> asyncio.Future
+    request_callback: Optional[Callable] = None  # Callback to notify UI of pending requests
+    whitelist_checker: Optional[Callable] = None  # Callback to check if request is whitelisted
 
 
 _state = _ACPState()
@@ -42,16 +56,8 @@ _state = _ACPState()
 
 def reset_state() -> None:
     """Reset ACP client state (primarily for tests)."""
-    _state.agent_proc = None
-    _state.agent_reader = None
-    _state.agent_writer = None
-    _state.agent_lock = asyncio.Lock()
-    _state.request_lock = asyncio.Lock()
-    _state.session_id = None
-    _state.request_id = 0
-    _state.pending_requests = {}
-    _state.request_callback = None
-    _state.whitelist_checker = None
+    global _state
+    _state = _ACPState()
 
 
 def get_state() -> _ACPState:
@@ -96,23 +102,63 @@ def _next_request_id():
     return _state.request_id
 
 
-async def _read_frame(reader) -> list[dict]:
+async def _read_frame(reader, skip_updates: bool = False) -> list[dict]:
     """Read a JSON-RPC frame from the agent, returning a list of messages.
 
     - Returns empty list for blank lines
     - Returns [msg] for single JSON objects
     - Returns list of dicts for JSON-RPC batches
+    - Returns empty list for session/update notifications if skip_updates is
+      set, without parsing them
     - Raises RuntimeError if connection closed
     """
     line = await reader.readline()
     if not line:
         raise RuntimeError("Agent connection closed")
+    if skip_updates and peek_method(line) == "session/update":
+        return []
     messages = parse_frame(line)
     # If line was non-empty but parse_frame returned [], it was invalid JSON
     # which is already logged by parse_frame; we continue reading
     return messages
 
 
+async def _read_frame_timed(reader, skip_updates: bool = False) -> list[dict]:
+    """Read the next frame(s), raising TimeoutError after AGENT_READ_TIMEOUT."""
+    if _HAS_ASYNCIO_TIMEOUT:
+        async with asyncio.timeout(AGENT_READ_TIMEOUT):
+            return await _read_frame(reader, skip_updates=skip_updates)
+    return await asyncio.wait_for(_read_frame(reader, skip_updates=skip_updates), timeout=AGENT_READ_TIMEOUT)
+
+
+async def _write_message(message: dict) -> None:
+    """Send one JSON-RPC message to the agent as a newline-terminated line."""
+    # writelines avoids concatenating the (possibly large) body with the newline
+    _state.agent_writer.writelines((orjson.dumps(message, option=orjson.OPT_NON_STR_KEYS), b"\n"))
+    await _state.agent_writer.drain()
+
+
+async def _drain_buffered_frames(reader, skip_updates: bool = False) -> list[dict]:
+    """Parse every complete frame already buffered in the reader.
+
+    readline() on a line that is already buffered returns without suspending,
+    so a burst of notifications is handled in one pass instead of one
+    timed-out wait (and event loop round trip) per frame. Stops after a
+    response so frames meant for a later request stay in the reader.
+    """
+    messages: list[dict] = []
+    buffer = getattr(reader, "_buffer", None)  # StreamReader internals
+    if not isinstance(buffer, bytearray):
+        return messages
+    while b"\n" in buffer:
+        frame = await _read_frame(reader, skip_updates)
+        messages.extend(frame)
+        # Leave anything after a response buffered for whoever reads next
+        if any(classify_frame(msg) == "response" for msg in frame):
+            break
+    return messages
+
+
 async def _read_single_response(reader) -> dict:
     """Read frames until we get at least one message, return the first."""
     while True:
@@ -133,9 +179,7 @@ async def _send_request(method: str, params: dict, collect_updates: bool = False
         "params": params
     }
     
-    data = json.dumps(request) + "\n"
-    _state.agent_writer.write(data.encode())
-    await _state.agent_writer.drain()
+    await _write_message(request)
     
     # Per-turn state for aggregation (no cross-request bleed)
     turn = TurnState(turn_id=request["id"])
@@ -145,7 +189,10 @@ async def _send_request(method: str, params: dict, collect_updates: bool = False
     # Read responses until we get the one matching our request ID
     while True:
         # Read frame(s) - may return multiple messages for batches
-        messages = await asyncio.wait_for(_read_frame(_state.agent_reader), timeout=300)
+        # Updates are only parsed when the caller is collecting them
+        messages = await _read_frame_timed(_state.agent_reader, skip_updates=not collect_updates)
+        if not any(classify_frame(msg) == "response" for msg in messages):
+            messages += await _drain_buffered_frames(_state.agent_reader, skip_updates=not collect_updates)
         if not messages:
             continue  # blank line or invalid JSON, already logged
         
@@ -228,6 +275,8 @@ async def _send_request(method: str, params: dict, collect_updates: bool = False
                     if content:
                         content_blocks = []
                         _collect_content_blocks(content, content_blocks)
+                        # Update-level hints apply to every block, so check them once
+                        update_is_thinking = is_thinking_content(update)
 
                         for block in content_blocks:
                             # Only collect assistant final content; skip thoughts/plans/user echoes/tool-related content
@@ -235,7 +284,7 @@ async def _send_request(method: str, params: dict, collect_updates: bool = False
                                 if session_update_type in ("agent_thought_chunk", "user_message_chunk", "plan", "tool_call", "tool_call_update"):
                                     continue
 
-                                if is_thinking_content(update, block):
+                                if update_is_thinking or get_block_segment_kind(block) in THINKING_KINDS:
                                     continue
 
                             # Skip non-text blocks from tool calls and plans as well
@@ -243,19 +292,10 @@ async def _send_request(method: str, params: dict, collect_updates: bool = False
                                 continue
 
                             # Avoid accumulating repeated snapshot chunks, but still support delta streams.
-                            target_list = turn.post_tool_blocks if turn.saw_any_tool_call else turn.pre_tool_blocks
-                            if session_update_type == "agent_message_chunk" and block.get("type") == "text":
-                                if target_list and target_list[-1].get("type") == "text":
-                                    prev = target_list[-1].get("text") or ""
-                                    curr = block.get("text") or ""
-                                    if curr and curr.startswith(prev):
-                                        target_list[-1] = block
-                                    else:
-                                        target_list.append(block)
-                                else:
-                                    target_list.append(block)
+                            if session_update_type == "agent_message_chunk":
+                                turn.add_message_chunk(block)
                             else:
-                                target_list.append(block)
+                                turn.add_content_block(block)
                 continue
             
             # Handle requests from agent (has id, has method) - agent asking client for something
@@ -343,9 +383,7 @@ async def _send_request(method: str, params: dict, collect_updates: bool = False
                         "id": req_id,
                         "result": {"outcome": outcome_obj}
                     }
-                    data = json.dumps(permission_response) + "\n"
-                    _state.agent_writer.write(data.encode())
-                    await _state.agent_writer.drain()
+                    await _write_message(permission_response)
 
                     if permission_cancelled:
                         await stop_agent()
@@ -361,9 +399,7 @@ async def _send_request(method: str, params: dict, collect_updates: bool = False
                         "id": req_id,
                         "error": {"code": -32601, "message": "Method not supported"}
                     }
-                    data = json.dumps(error_response) + "\n"
-                    _state.agent_writer.write(data.encode())
-                    await _state.agent_writer.drain()
+                    await _write_message(error_response)
                     continue
                 elif method_name.startswith("terminal/"):
                     # Terminal requests - we don't support these yet
@@ -373,9 +409,7 @@ async def _send_request(method: str, params: dict, collect_updates: bool = False
                         "id": req_id,
                         "error": {"code": -32601, "message": "Method not supported"}
                     }
-                    data = json.dumps(error_response) + "\n"
-                    _state.agent_writer.write(data.encode())
-                    await _state.agent_writer.drain()
+                    await _write_message(error_response)
                     continue
                 else:
                     logger.warning(f"Unknown agent request: {method_name}")
@@ -389,9 +423,11 @@ async def _send_request(method: str, params: dict, collect_updates: bool = False
                 if permission_cancelled:
                     result["_cancelled"] = True
                 if collect_updates:
-                    # Log the raw result for debugging
-                    logger.debug(f"Final result keys: {list(result.keys())}")
-                    logger.debug(f"Final result: {json.dumps(result, indent=2)[:500]}")
+                    # Log the raw result for debugging; only serialize it when debug is on,
+                    # since results can carry megabytes of inline base64 content
+                    if logger.isEnabledFor(logging.DEBUG):
+                        logger.debug(f"Final result keys: {list(result.keys())}")
+                        logger.debug(f"Final result: {json.dumps(result, indent=2)[:500]}")
                     
                     result_blocks = []
                     
@@ -433,46 +469,25 @@ async def _send_request(method: str, params: dict, collect_updates: bool = False
 
 def _collect_content_blocks(content, collected: list):
     """Extract content blocks from ACP content (handles dict or list)."""
-    if isinstance(content, dict):
-        if content.get("type") == "content" and "content" in content:
-            _collect_content_blocks(content.get("content"), collected)
-            return
-        if "type" in content:
-            block = _parse_content_block(content)
-            if block:
-                collected.append(block)
-            return
-        if "content" in content:
-            nested = content.get("content")
-            if nested is not content:
-                _collect_content_blocks(nested, collected)
-        else:
-            block = _parse_content_block(content)
+    # Depth-first walk with an explicit stack (pushed in reverse to keep order)
+    stack = [content]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, list):
+            # Only dict items are content; nested bare lists are ignored
+            stack.extend(item for item in reversed(node) if isinstance(item, dict))
+            continue
+        if not isinstance(node, dict):
+            continue
+        if "type" in node and not (node["type"] == "content" and "content" in node):
+            block = _parse_content_block(node)
             if block:
                 collected.append(block)
-    elif isinstance(content, list):
-        for item in content:
-            if isinstance(item, dict):
-                if item.get("type") == "content" and "content" in item:
-                    _collect_content_blocks(item.get("content"), collected)
-                    continue
-                if "type" in item:
-                    block = _parse_content_block(item)
-                    if block:
-                        collected.append(block)
-                    continue
-                if "content" in item:
-                    nested = item.get("content")
-                    if nested is not item:
-                        _collect_content_blocks(nested, collected)
-                else:
-                    block = _parse_content_block(item)
-                    if block:
-                        collected.append(block)
-    else:
-        block = _parse_content_block(content)
-        if block:
-            collected.append(block)
+        elif "content" in node:
+            # Wrapper ({"type": "content", "content": ...}) or untyped container
+            nested = node["content"]
+            if nested is not node:
+                stack.append(nested)
 
 
 def _join_text_chunks(chunks: list[str]) -> str:
@@ -480,100 +495,107 @@ def _join_text_chunks(chunks: list[str]) -> str:
     return "".join(chunk for chunk in chunks if chunk)
 
 
+def _parse_text_block(block: dict) -> dict:
+    return {
+        "type": "text",
+        "text": block.get("text", "")
+    }
+
+
+def _parse_image_block(block: dict) -> dict:
+    # Image can be inline (base64) or by URL
+    result = {"type": "image"}
+    if "data" in block:
+        result["data"] = block["data"]
+        result["encoding"] = "base64"
+    if "content" in block:
+        result["data"] = block["content"]
+        result["encoding"] = block.get("content_encoding", "base64")
+    if "uri" in block:
+        result["url"] = block["uri"]
+    if "content_url" in block:
+        result["url"] = block["content_url"]
+    if "mimeType" in block:
+        result["mime_type"] = block["mimeType"]
+    elif "content_type" in block:
+        result["mime_type"] = block["content_type"]
+    else:
+        result["mime_type"] = "image/png"  # Default
+    if "name" in block:
+        result["name"] = block["name"]
+    return result
+
+
+def _parse_resource_link_block(block: dict) -> dict:
+    # Resource link (MCP-compatible)
+    return {
+        "type": "resource_link",
+        "name": block.get("name", "resource"),
+        "uri": block.get("uri"),
+        "mime_type": block.get("mimeType", "application/octet-stream"),
+        "description": block.get("description"),
+        "title": block.get("title"),
+        "size": block.get("size"),
+    }
+
+
+def _parse_resource_block(block: dict) -> dict:
+    # Embedded resource (text or blob)
+    resource = block.get("resource", {})
+    result = {
+        "type": "resource",
+        "uri": resource.get("uri"),
+        "mime_type": resource.get("mimeType", "text/plain"),
+    }
+    if "text" in resource:
+        result["text"] = resource["text"]
+    if "blob" in resource:
+        result["data"] = resource["blob"]
+        result["encoding"] = "base64"
+    return result
+
+
+def _parse_file_block(block: dict) -> dict:
+    # File/artifact with content or URL
+    result = {
+        "type": "file",
+        "name": block.get("name", "unnamed"),
+        "mime_type": block.get("content_type", "application/octet-stream")
+    }
+    if "content" in block:
+        result["data"] = block["content"]
+        result["encoding"] = block.get("content_encoding", "base64")
+    if "content_url" in block:
+        result["url"] = block["content_url"]
+    return result
+
+
+# Content block handlers keyed by ACP block type
+_BLOCK_HANDLERS: dict[str, Callable[[dict], dict]] = {
+    "text": _parse_text_block,
+    "image": _parse_image_block,
+    "resource_link": _parse_resource_link_block,
+    "resource": _parse_resource_block,
+    "file": _parse_file_block,
+    "artifact": _parse_file_block,
+}
+
+
 def _parse_content_block(block: dict) -> dict | None:
     """Parse a single ACP content block into our internal format."""
     if not isinstance(block, dict):
         return None
     content_type = block.get("type")
-    annotations = block.get("annotations")
-    
-    if content_type == "text":
-        result = {
-            "type": "text",
-            "text": block.get("text", "")
-        }
-        if annotations:
-            result["annotations"] = annotations
-        return result
-    
-    elif content_type == "image":
-        # Image can be inline (base64) or by URL
-        result = {"type": "image"}
-        if "data" in block:
-            result["data"] = block["data"]
-            result["encoding"] = "base64"
-        if "content" in block:
-            result["data"] = block["content"]
-            result["encoding"] = block.get("content_encoding", "base64")
-        if "uri" in block:
-            result["url"] = block["uri"]
-        if "content_url" in block:
-            result["url"] = block["content_url"]
-        if "mimeType" in block:
-            result["mime_type"] = block["mimeType"]
-        elif "content_type" in block:
-            result["mime_type"] = block["content_type"]
-        else:
-            result["mime_type"] = "image/png"  # Default
-        if "name" in block:
-            result["name"] = block["name"]
-        if annotations:
-            result["annotations"] = annotations
-        return result
-    
-    elif content_type == "resource_link":
-        # Resource link (MCP-compatible)
-        result = {
-            "type": "resource_link",
-            "name": block.get("name", "resource"),
-            "uri": block.get("uri"),
-            "mime_type": block.get("mimeType", "application/octet-stream"),
-            "description": block.get("description"),
-            "title": block.get("title"),
-            "size": block.get("size"),
-        }
-        if annotations:
-            result["annotations"] = annotations
-        return result
+    handler = _BLOCK_HANDLERS.get(content_type)
+    if handler is None:
+        # Unknown type - preserve as-is
+        return block if content_type else None
     
-    elif content_type == "resource":
-        # Embedded resource (text or blob)
-        resource = block.get("resource", {})
-        result = {
-            "type": "resource",
-            "uri": resource.get("uri"),
-            "mime_type": resource.get("mimeType", "text/plain"),
-        }
-        if "text" in resource:
-            result["text"] = resource["text"]
-        if "blob" in resource:
-            result["data"] = resource["blob"]
-            result["encoding"] = "base64"
-        if annotations:
-            result["annotations"] = annotations
-        return result
-    
-    elif content_type == "file" or content_type == "artifact":
-        # File/artifact with content or URL
-        result = {
-            "type": "file",
-            "name": block.get("name", "unnamed"),
-            "mime_type": block.get("content_type", "application/octet-stream")
-        }
-        if "content" in block:
-            result["data"] = block["content"]
-            result["encoding"] = block.get("content_encoding", "base64")
-        if "content_url" in block:
-            result["url"] = block["content_url"]
-        if annotations:
-            result["annotations"] = annotations
-        return result
-    
-    # Unknown type - preserve as-is
-    elif content_type:
-        return block
-    
-    return None
+    result = handler(block)
+    annotations = block.get("annotations")
+    if annotations:
+        result["annotations"] = annotations
+    return result
 
 
 async def _ensure_agent():
@@ -609,6 +631,7 @@ async def _ensure_agent():
             stdin=asyncio.subprocess.PIPE,
             stdout=asyncio.subprocess.PIPE,
             stderr=asyncio.subprocess.PIPE,
+            limit=AGENT_READ_LIMIT,
         )
         
         _state.agent_reader = _state.agent_proc.stdout
@@ -820,9 +843,7 @@ async def stop_agent():
                     "method": "session/cancel",
                     "params": {"sessionId": _state.session_id, "_meta": {}}
                 }
-                data = json.dumps(cancel_notification) + "\n"
-                _state.agent_writer.write(data.encode())
-                await _state.agent_writer.drain()
+                await _write_message(cancel_notification)
                 logger.info(f"Sent session/cancel for session {_state.session_id}")
             except Exception as e:
                 logger.warning(f"Failed to send session/cancel: {e}")
@@ -853,9 +874,7 @@ async def cancel_session():
                 "method": "session/cancel",
                 "params": {"sessionId": _state.session_id, "_meta": {}}
             }
-            data = json.dumps(cancel_notification) + "\n"
-            _state.agent_writer.write(data.encode())
-            await _state.agent_writer.drain()
+            await _write_message(cancel_notification)
             logger.info(f"Sent session/cancel for session {_state.session_id}")
             return True
         except Exception as e:
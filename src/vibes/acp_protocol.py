@@ -6,10 +6,12 @@ All routing decisions are metadata-based (no payload heuristics).
 
 from __future__ import annotations
 
-import json
 import logging
+import re
 from dataclasses import dataclass, field
-from typing import Any, Literal
+from typing import Any, ClassVar, Literal
+
+import orjson
 
 from .config import get_config
 
@@ -23,6 +25,16 @@ logger = logging.getLogger(__name__)
 FrameKind = Literal["notification", "request", "response", "invalid"]
 
 
+# Bit 0: "method", bit 1: "id", bit 2: "result" or "error". Unlisted signatures are invalid.
+_FRAME_KINDS: dict[int, FrameKind] = {
+    0b001: "notification",
+    0b101: "notification",
+    0b011: "request",
+    0b111: "request",
+    0b110: "response",
+}
+
+
 def classify_frame(msg: dict) -> FrameKind:
     """Classify a JSON-RPC message as notification, request, response, or invalid.
 
@@ -34,17 +46,8 @@ def classify_frame(msg: dict) -> FrameKind:
     if not isinstance(msg, dict):
         return "invalid"
 
-    has_id = "id" in msg
-    has_method = "method" in msg
-    has_result_or_error = "result" in msg or "error" in msg
-
-    if has_method and not has_id:
-        return "notification"
-    if has_method and has_id:
-        return "request"
-    if has_id and has_result_or_error and not has_method:
-        return "response"
-    return "invalid"
+    sig = ("method" in msg) | ("id" in msg) << 1 | ("result" in msg or "error" in msg) << 2
+    return _FRAME_KINDS.get(sig, "invalid")
 
 
 def is_notification(msg: dict) -> bool:
@@ -64,6 +67,9 @@ def is_response(msg: dict) -> bool:
 # ---------------------------------------------------------------------------
 
 
+_FRAME_START_BYTES = b"{["
+
+
 def parse_frame(line: bytes) -> list[dict]:
     """Parse a line from stdio into a list of JSON-RPC messages.
 
@@ -76,20 +82,19 @@ def parse_frame(line: bytes) -> list[dict]:
     if not stripped:
         return []
 
-    debug = get_config().acp_debug
+    if get_config().acp_debug:
+        logger.debug(f"ACP < {stripped[:500].decode('utf-8', 'replace')}")
 
-    try:
-        decoded = stripped.decode("utf-8")
-    except UnicodeDecodeError as e:
-        logger.warning(f"ACP: non-UTF8 line ignored: {e}")
+    # Agents sometimes print log lines on stdout; anything that cannot be an
+    # object or batch is dropped without paying for a failed JSON parse.
+    if stripped[0] not in _FRAME_START_BYTES:
+        logger.warning(f"ACP: non-JSON-RPC line ignored: {stripped[:80]!r}")
         return []
 
-    if debug:
-        logger.debug(f"ACP < {decoded[:500]}")
-
+    # orjson parses bytes directly and rejects invalid UTF-8 itself
     try:
-        data = json.loads(decoded)
-    except json.JSONDecodeError as e:
+        data = orjson.loads(stripped)
+    except orjson.JSONDecodeError as e:
         logger.warning(f"ACP: invalid JSON ignored: {e}")
         return []
 
@@ -105,15 +110,45 @@ def parse_frame(line: bytes) -> list[dict]:
     return []
 
 
+# "method" comes right after "jsonrpc" in practice, so only the head of the
+# line is searched; anything not found there falls back to a full parse.
+_METHOD_PEEK_RE = re.compile(rb'^\s*\{[^{\[]*?"method"\s*:\s*"([^"\\]+)"')
+_METHOD_PEEK_WINDOW = 256
+
+
+def peek_method(line: bytes) -> str | None:
+    """Return the top-level method of a single-object frame without parsing it.
+
+    Only keys before the first nested object/array are considered, so a
+    "method" inside params is never mistaken for the frame's own. Returns
+    None when the method can't be determined cheaply.
+    """
+    match = _METHOD_PEEK_RE.match(line, 0, _METHOD_PEEK_WINDOW)
+    if match is None:
+        return None
+    return match.group(1).decode("utf-8", "replace")
+
+
 # ---------------------------------------------------------------------------
 # Tool Call State Management
 # ---------------------------------------------------------------------------
 
 
-@dataclass
+@dataclass(slots=True)
 class ToolCallState:
     """State for a single tool call, keyed by toolCallId."""
 
+    # ACP update key -> attribute, applied in order by merge_update
+    _UPDATE_FIELDS: ClassVar[tuple[tuple[str, str], ...]] = (
+        ("title", "title"),
+        ("status", "status"),
+        ("kind", "kind"),
+        ("rawInput", "raw_input"),
+        ("rawOutput", "raw_output"),
+        ("content", "content"),
+        ("locations", "locations"),
+    )
+
     tool_call_id: str
     title: str = "Tool call"
     status: str | None = None
@@ -125,18 +160,10 @@ class ToolCallState:
 
     def merge_update(self, update: dict) -> None:
         """Merge fields from a tool_call_update, ignoring None values."""
-        for key in ("title", "status", "kind"):
+        for key, attr in self._UPDATE_FIELDS:
             val = update.get(key)
             if val is not None:
-                setattr(self, key, val)
-        if update.get("rawInput") is not None:
-            self.raw_input = update["rawInput"]
-        if update.get("rawOutput") is not None:
-            self.raw_output = update["rawOutput"]
-        if update.get("content") is not None:
-            self.content = update["content"]
-        if update.get("locations") is not None:
-            self.locations = update["locations"]
+                setattr(self, attr, val)
 
     def to_dict(self) -> dict:
         return {
@@ -210,6 +237,17 @@ class TurnState:
         target = self.post_tool_blocks if self.saw_any_tool_call else self.pre_tool_blocks
         target.append(block)
 
+    def add_message_chunk(self, block: dict) -> None:
+        """Add an agent_message_chunk block, replacing the last text block when it is a growing snapshot."""
+        target = self.post_tool_blocks if self.saw_any_tool_call else self.pre_tool_blocks
+        if target and block.get("type") == "text" and target[-1].get("type") == "text":
+            prev = target[-1].get("text") or ""
+            curr = block.get("text") or ""
+            if curr and curr.startswith(prev):
+                target[-1] = block
+                return
+        target.append(block)
+
     def get_final_blocks(self) -> list[dict]:
         """Return the content blocks to use for the final response."""
         if self.saw_any_tool_call:
@@ -244,36 +282,40 @@ class TurnState:
 THINKING_KINDS = frozenset({"think", "thought", "thinking", "segment", "intent", "plan"})
 
 
+_SEGMENT_ANNOTATION_TYPES = ("segment", "thinking", "intent")
+_ANNOTATION_KIND_KEYS = ("kind", "segment", "role", "channel", "name", "value")
+
+
+def _annotation_segment_kind(a: dict) -> str | None:
+    """Classify one annotation dict, returning its segment kind if it has one."""
+    a_type = (a.get("type") or a.get("annotation") or "").lower()
+    kind = None
+    for key in _ANNOTATION_KIND_KEYS:
+        kind = a.get(key)
+        if kind:
+            break
+    kind = kind.lower() if isinstance(kind, str) else None
+
+    if a_type in _SEGMENT_ANNOTATION_TYPES:
+        return kind or a_type
+    if kind in THINKING_KINDS:
+        return kind
+    return None
+
+
 def segment_kind_from_annotations(annotations: Any) -> str | None:
     """Extract segment/thinking kind from ACP annotations (metadata-only)."""
     if not annotations:
         return None
-
-    candidates: list[dict] = []
     if isinstance(annotations, dict):
-        candidates = [annotations]
-    elif isinstance(annotations, list):
-        candidates = [a for a in annotations if isinstance(a, dict)]
-    else:
-        return None
-
-    for a in candidates:
-        a_type = (a.get("type") or a.get("annotation") or "").lower()
-        kind = (
-            a.get("kind")
-            or a.get("segment")
-            or a.get("role")
-            or a.get("channel")
-            or a.get("name")
-            or a.get("value")
+        return _annotation_segment_kind(annotations)
+    if isinstance(annotations, list):
+        # Single pass, stops at the first classified annotation
+        return next(
+            (kind for a in annotations
+             if isinstance(a, dict) and (kind := _annotation_segment_kind(a))),
+            None,
         )
-        kind = kind.lower() if isinstance(kind, str) else None
-
-        if a_type in ("segment", "thinking", "intent"):
-            return kind or a_type
-        if kind in THINKING_KINDS:
-            return kind
-
     return None
 
 
@@ -291,21 +333,24 @@ def get_update_segment_kind(update: dict, block: dict | None = None) -> str | No
             return hint
 
     if block:
-        block_hint = (
-            block.get("segment")
-            or block.get("channel")
-            or block.get("role")
-        )
-        if isinstance(block_hint, str) and block_hint.lower() in THINKING_KINDS:
-            return block_hint.lower()
-
-        ann_kind = segment_kind_from_annotations(block.get("annotations"))
-        if ann_kind:
-            return ann_kind
+        return get_block_segment_kind(block)
 
     return None
 
 
+def get_block_segment_kind(block: dict) -> str | None:
+    """Get segment kind from a content block's own metadata and annotations."""
+    block_hint = (
+        block.get("segment")
+        or block.get("channel")
+        or block.get("role")
+    )
+    if isinstance(block_hint, str) and block_hint.lower() in THINKING_KINDS:
+        return block_hint.lower()
+
+    return segment_kind_from_annotations(block.get("annotations"))
+
+
 def is_thinking_content(update: dict, block: dict | None = None) -> bool:
     """Check if content should be routed to thinking pane (not final output)."""
     kind = get_update_segment_kind(update, block)
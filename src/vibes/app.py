@@ -48,7 +48,7 @@ async def index_handler(request: web.Request) -> web.FileResponse:
 async def on_startup(app: web.Application) -> None:
     """Application startup handler."""
     config = get_config()
-    await init_db(config.db_path)
+    await init_db(config.db_path, readers=config.db_readers)
     logger.info(f"Database initialized at {config.db_path}")
     
     await start_task_queue(num_workers=3)
@@ -43,6 +43,7 @@ class Config:
         self.host: str = _get_env("VIBES_HOST", "0.0.0.0")
         self.port: int = _get_env_int("VIBES_PORT", 8080)
         self.db_path: str = _get_env("VIBES_DB_PATH", "database/vibes.db")
+        self.db_readers: int = _get_env_int("VIBES_DB_READERS", 2)
         self.debug: bool = _get_env_bool("VIBES_DEBUG", False)
         self.custom_endpoints: dict = {}
         
@@ -1,14 +1,52 @@
 """Database layer for Vibes using SQLite with JSON columns and BLOBs."""
 
 import aiosqlite
-import json
+import orjson
+import re
+import sqlite3
 from pathlib import Path
-from typing import Optional
+from typing import AsyncIterator, Optional
 from contextlib import asynccontextmanager
 
 DEFAULT_DB_PATH = "data/app.db"
 
-SCHEMA_VERSION = 3
+SCHEMA_VERSION = 7
+
+# Same hashtag syntax the frontend linkifies (HASHTAG_REGEX in app.js); JS \w
+# is ASCII-only, so "#café" must index as "caf" here too
+HASHTAG_RE = re.compile(r"#(\w+)", re.ASCII)
+
+# INSERT ... RETURNING needs SQLite 3.35+
+_HAS_RETURNING = aiosqlite.sqlite_version_info >= (3, 35, 0)
+
+# Rows per multi-row INSERT in create_interactions_bulk (well under the bind limit)
+BULK_INSERT_ROWS = 500
+
+# Incremental blob I/O (Connection.blobopen) needs Python 3.11+
+_HAS_BLOBOPEN = hasattr(sqlite3.Connection, "blobopen")
+MEDIA_CHUNK_SIZE = 64 * 1024
+
+# Per-connection tuning applied to the writer and every reader. page_size only
+# takes effect on a brand-new file, so it is issued before anything is written.
+CONNECTION_PRAGMAS = (
+    "PRAGMA page_size = 8192",
+    "PRAGMA mmap_size = 268435456",  # 256 MiB; reads map pages instead of read() calls
+    "PRAGMA cache_size = -64000",  # ~64 MB page cache
+    "PRAGMA temp_store = MEMORY",
+)
+
+# Both pagination shapes are built once so every call reuses the same SQL text
+# (and so the same entry in sqlite3's prepared statement cache)
+_HASHTAG_POSTS_TEMPLATE = """SELECT i.id, i.timestamp, i.data,
+          (SELECT COUNT(*) FROM interactions r WHERE r.thread_id = i.id) as reply_count
+   FROM post_hashtags h
+   JOIN interactions i ON i.id = h.post_id
+   WHERE h.hashtag = ?
+   {cursor_clause}
+   ORDER BY h.post_id DESC
+   LIMIT ?"""
+_HASHTAG_POSTS_SQL = _HASHTAG_POSTS_TEMPLATE.format(cursor_clause="")
+_HASHTAG_POSTS_BEFORE_SQL = _HASHTAG_POSTS_TEMPLATE.format(cursor_clause="AND h.post_id < ?")
 
 SCHEMA = """
 -- Interactions table with JSON data and virtual columns for indexing
@@ -105,12 +143,55 @@ END;
 """
 
 
+# Migration to add content hashes to media (dedupes uploads and thumbnail work)
+# (the ALTER is guarded in _init_schema so a partial run can be retried)
+MIGRATION_V4_COLUMN = "ALTER TABLE media ADD COLUMN sha256 TEXT"
+MIGRATION_V4 = """
+CREATE INDEX IF NOT EXISTS idx_media_sha256 ON media(sha256);
+"""
+
+# Migration to index hashtags at write time instead of scanning content
+MIGRATION_V5 = """
+CREATE TABLE IF NOT EXISTS post_hashtags (
+    hashtag TEXT NOT NULL COLLATE NOCASE,
+    post_id INTEGER NOT NULL REFERENCES interactions(id) ON DELETE CASCADE,
+    PRIMARY KEY (hashtag, post_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_post_hashtags_post_id ON post_hashtags(post_id);
+"""
+
+# Migration to index cached OpenGraph images by their source URL
+MIGRATION_V6 = """
+ALTER TABLE media ADD COLUMN original_url TEXT
+    GENERATED ALWAYS AS (json_extract(metadata, '$.original_url')) VIRTUAL;
+CREATE INDEX IF NOT EXISTS idx_media_original_url ON media(original_url);
+"""
+
+
+def _dump_json(value) -> str:
+    """Serialize a JSON column value (TEXT, since JSON1 functions reject BLOBs)."""
+    return orjson.dumps(value, option=orjson.OPT_NON_STR_KEYS).decode()
+
+
+def extract_hashtags(content: Optional[str]) -> set[str]:
+    """Extract the distinct, lowercased hashtags from post content."""
+    if not isinstance(content, str):
+        return set()
+    return {tag.lower() for tag in HASHTAG_RE.findall(content)}
+
+
 class Database:
     """Async SQLite database wrapper with JSON and BLOB support."""
 
-    def __init__(self, db_path: str = DEFAULT_DB_PATH):
+    def __init__(self, db_path: str = DEFAULT_DB_PATH, readers: int = 0):
         self.db_path = db_path
         self._connection: Optional[aiosqlite.Connection] = None
+        # Optional read-only connections; under WAL they read alongside the writer
+        self._num_readers = readers
+        self._readers: list[aiosqlite.Connection] = []
+        self._next_reader = 0
+        # Whitelist patterns cached in memory; None means reload on next check
+        self._whitelist_patterns: Optional[list[str]] = None
 
     async def connect(self) -> None:
         """Connect to the database and ensure schema is initialized."""
@@ -120,27 +201,54 @@ class Database:
         self._connection = await aiosqlite.connect(self.db_path)
         self._connection.row_factory = aiosqlite.Row
         
-        # Enable foreign keys and WAL mode for better performance
+        for pragma in CONNECTION_PRAGMAS:
+            await self._connection.execute(pragma)
+        
+        # Enable foreign keys and WAL mode for better performance; with WAL,
+        # synchronous=NORMAL only syncs at checkpoints and stays crash-safe
         await self._connection.execute("PRAGMA foreign_keys = ON")
         await self._connection.execute("PRAGMA journal_mode = WAL")
+        await self._connection.execute("PRAGMA synchronous = NORMAL")
         
         await self._init_schema()
+        
+        for _ in range(self._num_readers):
+            self._readers.append(await self._open_reader())
+
+    async def _open_reader(self) -> aiosqlite.Connection:
+        """Open a tuned, query-only connection to the database."""
+        reader = await aiosqlite.connect(self.db_path)
+        reader.row_factory = aiosqlite.Row
+        for pragma in CONNECTION_PRAGMAS:
+            await reader.execute(pragma)
+        await reader.execute("PRAGMA query_only = ON")
+        return reader
 
     async def close(self) -> None:
         """Close the database connection."""
+        for reader in self._readers:
+            await reader.close()
+        self._readers = []
         if self._connection:
             await self._connection.close()
             self._connection = None
 
+    def _reader(self) -> aiosqlite.Connection:
+        """Pick the connection for a read-only query (round-robin over readers)."""
+        if not self._readers:
+            return self._connection
+        self._next_reader = (self._next_reader + 1) % len(self._readers)
+        return self._readers[self._next_reader]
+
     async def _init_schema(self) -> None:
         """Initialize database schema if needed."""
         # Check current schema version
         try:
             async with self._connection.execute(
-                "SELECT version FROM schema_version LIMIT 1"
+                "SELECT MAX(version) AS version FROM schema_version"
             ) as cursor:
                 row = await cursor.fetchone()
-                current_version = row["version"] if row else 0
+                current_version = row["version"] if row and row["version"] else 0
         except aiosqlite.OperationalError:
             current_version = 0
 
@@ -151,6 +259,22 @@ class Database:
             # Migration to v3: add FTS
             if current_version < 3:
                 await self._connection.executescript(MIGRATION_V3)
+            # Migration to v4: add media content hash
+            if current_version < 4:
+                if not await self._column_exists("media", "sha256"):
+                    await self._connection.execute(MIGRATION_V4_COLUMN)
+                await self._connection.executescript(MIGRATION_V4)
+            # Migration to v5: hashtag join table, backfilled from existing posts
+            if current_version < 5:
+                await self._connection.executescript(MIGRATION_V5)
+                await self._backfill_hashtags()
+            # Migration to v6: indexed generated column for media original_url
+            if current_version < 6 and not await self._column_exists("media", "original_url"):
+                await self._connection.executescript(MIGRATION_V6)
+            # Migration to v7: re-index hashtags v5 extracted with Unicode \w
+            if 5 <= current_version < 7:
+                await self._connection.execute("DELETE FROM post_hashtags")
+                await self._backfill_hashtags()
             
             await self._connection.execute(
                 "INSERT OR REPLACE INTO schema_version (version) VALUES (?)",
@@ -158,6 +282,22 @@ class Database:
             )
             await self._connection.commit()
 
+    async def _column_exists(self, table: str, column: str) -> bool:
+        """Check whether a column (including generated ones) exists on a table."""
+        async with self._connection.execute(f"PRAGMA table_xinfo({table})") as cursor:
+            return any(row["name"] == column for row in await cursor.fetchall())
+
+    async def _backfill_hashtags(self) -> None:
+        """Populate post_hashtags for interactions created before v5."""
+        async with self._connection.execute(
+            "SELECT id, json_extract(data, '$.content') AS content FROM interactions"
+        ) as cursor:
+            rows = await cursor.fetchall()
+        await self._connection.executemany(
+            "INSERT OR IGNORE INTO post_hashtags (hashtag, post_id) VALUES (?, ?)",
+            [(tag, row["id"]) for row in rows for tag in extract_hashtags(row["content"])]
+        )
+
     @asynccontextmanager
     async def transaction(self):
         """Context manager for database transactions."""
@@ -169,18 +309,58 @@ class Database:
             raise
 
     # Interaction methods
-    async def create_interaction(self, data: dict) -> int:
-        """Create a new interaction and return its ID."""
+    async def create_interaction(self, data: dict) -> dict:
+        """Create a new interaction and return it (same shape as get_interaction)."""
+        return (await self.create_interactions_bulk([data]))[0]
+
+    async def create_interactions_bulk(self, data_list: list[dict]) -> list[dict]:
+        """Create several interactions in one transaction, returned in input order."""
+        created = []
         async with self.transaction():
-            cursor = await self._connection.execute(
-                "INSERT INTO interactions (data) VALUES (?)",
-                (json.dumps(data),)
-            )
-            return cursor.lastrowid
+            for start in range(0, len(data_list), BULK_INSERT_ROWS):
+                batch = data_list[start:start + BULK_INSERT_ROWS]
+                payloads = [_dump_json(data) for data in batch]
+                if _HAS_RETURNING:
+                    # Rows get ascending ids in VALUES order; RETURNING order is unspecified
+                    values = ", ".join(["(?)"] * len(batch))
+                    async with self._connection.execute(
+                        f"INSERT INTO interactions (data) VALUES {values} RETURNING id, timestamp",
+                        payloads
+                    ) as cursor:
+                        rows = sorted(await cursor.fetchall(), key=lambda row: row["id"])
+                    keys = [(row["id"], row["timestamp"]) for row in rows]
+                else:
+                    keys = []
+                    for payload in payloads:
+                        cursor = await self._connection.execute(
+                            "INSERT INTO interactions (data) VALUES (?)",
+                            (payload,)
+                        )
+                        async with self._connection.execute(
+                            "SELECT timestamp FROM interactions WHERE id = ?",
+                            (cursor.lastrowid,)
+                        ) as ts_cursor:
+                            keys.append((cursor.lastrowid, (await ts_cursor.fetchone())["timestamp"]))
+                # Decode what was stored so callers get exactly what get_interaction would
+                created.extend(
+                    {"id": interaction_id, "timestamp": timestamp, "data": orjson.loads(payload)}
+                    for (interaction_id, timestamp), payload in zip(keys, payloads)
+                )
+            hashtag_rows = [
+                (tag, item["id"])
+                for item in created
+                for tag in extract_hashtags(item["data"].get("content"))
+            ]
+            if hashtag_rows:
+                await self._connection.executemany(
+                    "INSERT OR IGNORE INTO post_hashtags (hashtag, post_id) VALUES (?, ?)",
+                    hashtag_rows
+                )
+        return created
 
     async def get_interaction(self, interaction_id: int) -> Optional[dict]:
         """Get an interaction by ID."""
-        async with self._connection.execute(
+        async with self._reader().execute(
             "SELECT id, timestamp, data FROM interactions WHERE id = ?",
             (interaction_id,)
         ) as cursor:
@@ -189,12 +369,16 @@ class Database:
                 return {
                     "id": row["id"],
                     "timestamp": row["timestamp"],
-                    "data": json.loads(row["data"])
+                    "data": orjson.loads(row["data"])
                 }
             return None
 
-    async def get_timeline(self, limit: int = 50, before_id: int = None) -> list[dict]:
-        """Get timeline of all interactions (oldest first for chat view)."""
+    async def get_timeline(self, limit: int = 50, before_id: Optional[int] = None) -> list[dict]:
+        """Get timeline of all interactions (oldest first for chat view).
+
+        Pass the oldest id already shown as before_id to load the page above it;
+        the newest `limit` rows below that id are read straight off the rowid.
+        """
         if before_id:
             query = """SELECT id, timestamp, data
                        FROM interactions
@@ -209,37 +393,47 @@ class Database:
                        LIMIT ?"""
             params = (limit,)
         
-        async with self._connection.execute(query, params) as cursor:
+        async with self._reader().execute(query, params) as cursor:
             rows = await cursor.fetchall()
             # Reverse to get oldest-first order (chat style)
             return [
                 {
                     "id": row["id"],
                     "timestamp": row["timestamp"],
-                    "data": json.loads(row["data"])
+                    "data": orjson.loads(row["data"])
                 }
                 for row in reversed(rows)
             ]
 
-    async def get_posts_by_hashtag(self, hashtag: str, limit: int = 50, offset: int = 0) -> list[dict]:
-        """Get posts containing a specific hashtag with reply counts."""
-        # Search for hashtag in content (case-insensitive)
-        pattern = f'%#{hashtag}%'
-        async with self._connection.execute(
-            """SELECT i.id, i.timestamp, i.data,
-                      (SELECT COUNT(*) FROM interactions r WHERE r.thread_id = i.id) as reply_count
-               FROM interactions i
-               WHERE json_extract(i.data, '$.content') LIKE ? COLLATE NOCASE
-               ORDER BY i.timestamp DESC 
-               LIMIT ? OFFSET ?""",
-            (pattern, limit, offset)
+    async def has_interactions_before(self, interaction_id: int) -> bool:
+        """Check whether any interaction is older than the given id (rowid probe only)."""
+        async with self._reader().execute(
+            "SELECT EXISTS (SELECT 1 FROM interactions WHERE id < ?) AS found",
+            (interaction_id,)
         ) as cursor:
+            return bool((await cursor.fetchone())["found"])
+
+    async def get_posts_by_hashtag(self, hashtag: str, limit: int = 50, before_id: Optional[int] = None) -> list[dict]:
+        """Get posts containing a specific hashtag with reply counts (newest first).
+
+        Uses keyset pagination on id so deep pages cost the same as the first one.
+        """
+        # Tags are stored lowercased; COLLATE NOCASE alone only folds ASCII
+        hashtag = hashtag.lower()
+        if before_id:
+            query = _HASHTAG_POSTS_BEFORE_SQL
+            params = (hashtag, before_id, limit)
+        else:
+            query = _HASHTAG_POSTS_SQL
+            params = (hashtag, limit)
+
+        async with self._reader().execute(query, params) as cursor:
             rows = await cursor.fetchall()
             return [
                 {
                     "id": row["id"],
                     "timestamp": row["timestamp"],
-                    "data": json.loads(row["data"]),
+                    "data": orjson.loads(row["data"]),
                     "reply_count": row["reply_count"]
                 }
                 for row in rows
@@ -247,7 +441,7 @@ class Database:
 
     async def search(self, query: str, limit: int = 50, offset: int = 0) -> list[dict]:
         """Full-text search across interaction content."""
-        async with self._connection.execute(
+        async with self._reader().execute(
             """SELECT i.id, i.timestamp, i.data,
                       (SELECT COUNT(*) FROM interactions r WHERE r.thread_id = i.id) as reply_count,
                       snippet(interactions_fts, 0, '<mark>', '</mark>', '...', 32) as snippet
@@ -263,7 +457,7 @@ class Database:
                 {
                     "id": row["id"],
                     "timestamp": row["timestamp"],
-                    "data": json.loads(row["data"]),
+                    "data": orjson.loads(row["data"]),
                     "reply_count": row["reply_count"],
                     "snippet": row["snippet"]
                 }
@@ -272,7 +466,7 @@ class Database:
 
     async def get_thread(self, thread_id: int) -> list[dict]:
         """Get all interactions in a thread."""
-        async with self._connection.execute(
+        async with self._reader().execute(
             """SELECT id, timestamp, data FROM interactions 
                WHERE id = ? OR thread_id = ?
                ORDER BY timestamp ASC""",
@@ -283,7 +477,7 @@ class Database:
                 {
                     "id": row["id"],
                     "timestamp": row["timestamp"],
-                    "data": json.loads(row["data"])
+                    "data": orjson.loads(row["data"])
                 }
                 for row in rows
             ]
@@ -302,7 +496,7 @@ class Database:
                 {
                     "id": row["id"],
                     "timestamp": row["timestamp"],
-                    "data": json.loads(row["data"])
+                    "data": orjson.loads(row["data"])
                 }
                 for row in rows
             ]
@@ -315,7 +509,7 @@ class Database:
                ORDER BY timestamp DESC"""
         ) as cursor:
             async for row in cursor:
-                data = json.loads(row["data"])
+                data = orjson.loads(row["data"])
                 for preview in data.get("link_previews", []):
                     if preview.get("url") == url:
                         return preview
@@ -329,7 +523,7 @@ class Database:
                WHERE json_extract(data, '$.link_previews') IS NOT NULL"""
         ) as cursor:
             async for row in cursor:
-                data = json.loads(row["data"])
+                data = orjson.loads(row["data"])
                 for preview in data.get("link_previews", []):
                     url = preview.get("url")
                     if url and url not in cache:
@@ -338,23 +532,15 @@ class Database:
 
     async def update_interaction_previews(self, interaction_id: int, link_previews: list[dict]) -> bool:
         """Update an interaction's link_previews field."""
-        async with self._connection.execute(
-            "SELECT data FROM interactions WHERE id = ?",
-            (interaction_id,)
-        ) as cursor:
-            row = await cursor.fetchone()
-            if not row:
-                return False
-        
-        data = json.loads(row["data"])
-        data["link_previews"] = link_previews
-        
+        # Patch the field in place with JSON1 rather than a read-modify-write round trip
         async with self.transaction():
-            await self._connection.execute(
-                "UPDATE interactions SET data = ? WHERE id = ?",
-                (json.dumps(data), interaction_id)
+            cursor = await self._connection.execute(
+                "UPDATE interactions SET data = json_set(data, '$.link_previews', json(?)) WHERE id = ?",
+                (_dump_json(link_previews), interaction_id)
             )
-        return True
+            updated = cursor.rowcount > 0
+            await cursor.close()
+        return updated
 
     # Media methods
     async def create_media(
@@ -363,21 +549,22 @@ class Database:
         content_type: str,
         data: bytes,
         thumbnail: Optional[bytes] = None,
-        metadata: Optional[dict] = None
+        metadata: Optional[dict] = None,
+        sha256: Optional[str] = None
     ) -> int:
         """Store media in the database and return its ID."""
         async with self.transaction():
             cursor = await self._connection.execute(
-                """INSERT INTO media (filename, content_type, data, thumbnail, metadata) 
-                   VALUES (?, ?, ?, ?, ?)""",
+                """INSERT INTO media (filename, content_type, data, thumbnail, metadata, sha256) 
+                   VALUES (?, ?, ?, ?, ?, ?)""",
                 (filename, content_type, data, thumbnail, 
-                 json.dumps(metadata) if metadata else None)
+                 _dump_json(metadata) if metadata else None, sha256)
             )
             return cursor.lastrowid
 
     async def get_media(self, media_id: int) -> Optional[dict]:
         """Get media by ID (without data for listing)."""
-        async with self._connection.execute(
+        async with self._reader().execute(
             """SELECT id, filename, content_type, metadata, created_at 
                FROM media WHERE id = ?""",
             (media_id,)
@@ -388,7 +575,30 @@ class Database:
                     "id": row["id"],
                     "filename": row["filename"],
                     "content_type": row["content_type"],
-                    "metadata": json.loads(row["metadata"]) if row["metadata"] else None,
+                    "metadata": orjson.loads(row["metadata"]) if row["metadata"] else None,
+                    "created_at": row["created_at"]
+                }
+            return None
+
+    async def get_media_by_hash(self, sha256: str, filename: Optional[str] = None) -> Optional[dict]:
+        """Get media by content hash (without data), for deduplicating uploads.
+
+        With a filename, only media stored under that same name matches.
+        """
+        query = """SELECT id, filename, content_type, metadata, created_at 
+                   FROM media WHERE sha256 = ?"""
+        params: tuple = (sha256,)
+        if filename is not None:
+            query += " AND filename = ?"
+            params += (filename,)
+        async with self._connection.execute(query + " LIMIT 1", params) as cursor:
+            row = await cursor.fetchone()
+            if row:
+                return {
+                    "id": row["id"],
+                    "filename": row["filename"],
+                    "content_type": row["content_type"],
+                    "metadata": orjson.loads(row["metadata"]) if row["metadata"] else None,
                     "created_at": row["created_at"]
                 }
             return None
@@ -396,9 +606,7 @@ class Database:
     async def get_media_by_original_url(self, original_url: str) -> Optional[int]:
         """Get media ID by original URL (for OpenGraph image caching)."""
         async with self._connection.execute(
-            """SELECT id FROM media 
-               WHERE json_extract(metadata, '$.original_url') = ?
-               LIMIT 1""",
+            "SELECT id FROM media WHERE original_url = ? LIMIT 1",
             (original_url,)
         ) as cursor:
             row = await cursor.fetchone()
@@ -406,7 +614,7 @@ class Database:
 
     async def get_media_data(self, media_id: int) -> Optional[tuple[str, bytes]]:
         """Get media content type and data blob."""
-        async with self._connection.execute(
+        async with self._reader().execute(
             "SELECT content_type, data FROM media WHERE id = ?",
             (media_id,)
         ) as cursor:
@@ -415,9 +623,50 @@ class Database:
                 return (row["content_type"], row["data"])
             return None
 
+    async def get_media_info(self, media_id: int) -> Optional[tuple[str, int]]:
+        """Get media content type and size without loading the blob."""
+        async with self._reader().execute(
+            "SELECT content_type, length(data) AS size FROM media WHERE id = ?",
+            (media_id,)
+        ) as cursor:
+            row = await cursor.fetchone()
+            if row:
+                return (row["content_type"], row["size"])
+            return None
+
+    async def iter_media_data(self, media_id: int, chunk_size: int = MEDIA_CHUNK_SIZE) -> AsyncIterator[bytes]:
+        """Yield a media blob in chunks without materializing it in memory."""
+        if not _HAS_BLOBOPEN:
+            result = await self.get_media_data(media_id)
+            if result:
+                data = result[1]
+                for start in range(0, len(data), chunk_size):
+                    yield data[start:start + chunk_size]
+            return
+
+        # An open blob holds a read transaction, pinning its connection's WAL
+        # snapshot until the download ends, so stream from a private connection
+        # rather than one that other reads share. aiosqlite has no blob API, so
+        # the blob calls run on that connection's thread.
+        conn = await self._open_reader()
+        try:
+            try:
+                blob = await conn._execute(
+                    lambda: conn._conn.blobopen("media", "data", media_id, readonly=True)
+                )
+            except sqlite3.OperationalError:
+                return
+            try:
+                while chunk := await conn._execute(blob.read, chunk_size):
+                    yield chunk
+            finally:
+                await conn._execute(blob.close)
+        finally:
+            await conn.close()
+
     async def get_media_thumbnail(self, media_id: int) -> Optional[tuple[str, bytes]]:
         """Get media thumbnail (returns JPEG)."""
-        async with self._connection.execute(
+        async with self._reader().execute(
             "SELECT thumbnail FROM media WHERE id = ?",
             (media_id,)
         ) as cursor:
@@ -436,6 +685,7 @@ class Database:
                    VALUES (?, ?)""",
                 (pattern, description)
             )
+            self._whitelist_patterns = None
             return cursor.lastrowid
     
     async def remove_from_whitelist(self, pattern: str) -> bool:
@@ -445,6 +695,7 @@ class Database:
                 "DELETE FROM permission_whitelist WHERE pattern = ?",
                 (pattern,)
             )
+            self._whitelist_patterns = None
             return cursor.rowcount > 0
     
     async def get_whitelist(self) -> list[dict]:
@@ -465,24 +716,24 @@ class Database:
     
     async def is_whitelisted(self, title: str) -> bool:
         """Check if a tool call title matches any whitelist pattern."""
-        async with self._connection.execute(
-            "SELECT pattern FROM permission_whitelist"
-        ) as cursor:
-            rows = await cursor.fetchall()
-            for row in rows:
-                pattern = row["pattern"]
-                # Simple glob-style matching: * matches anything
-                if pattern == "*":
+        if self._whitelist_patterns is None:
+            async with self._connection.execute(
+                "SELECT pattern FROM permission_whitelist"
+            ) as cursor:
+                self._whitelist_patterns = [row["pattern"] for row in await cursor.fetchall()]
+        for pattern in self._whitelist_patterns:
+            # Simple glob-style matching: * matches anything
+            if pattern == "*":
+                return True
+            if pattern.endswith("*"):
+                if title.startswith(pattern[:-1]):
                     return True
-                if pattern.endswith("*"):
-                    if title.startswith(pattern[:-1]):
-                        return True
-                elif pattern.startswith("*"):
-                    if title.endswith(pattern[1:]):
-                        return True
-                elif pattern == title:
+            elif pattern.startswith("*"):
+                if title.endswith(pattern[1:]):
                     return True
-            return False
+            elif pattern == title:
+                return True
+        return False
 
 
 # Global database instance
@@ -497,10 +748,10 @@ async def get_db() -> Database:
     return _db
 
 
-async def init_db(db_path: str = DEFAULT_DB_PATH) -> Database:
+async def init_db(db_path: str = DEFAULT_DB_PATH, readers: int = 0) -> Database:
     """Initialize the global database instance."""
     global _db
-    _db = Database(db_path)
+    _db = Database(db_path, readers=readers)
     await _db.connect()
     return _db
 
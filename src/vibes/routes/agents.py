@@ -1,9 +1,10 @@
 """ACP agent route handlers."""
 
+import asyncio
 import base64
-import json
 import logging
 import re
+import orjson
 from aiohttp import web
 from ..db import get_db
 from ..config import get_config
@@ -14,7 +15,8 @@ from ..acp_client import (
     prompt_from_action
 )
 from ..tasks import enqueue
-from .sse import broadcast_event
+from .media import generate_thumbnail, media_digest
+from .sse import broadcast_event, has_subscribers
 
 _DATA_URI_MARKDOWN_IMAGE_RE = re.compile(
     r"!\[(?P<alt>[^\]]*)\]\((?P<uri>data:(?P<mime>image/[^;\)]+);base64,(?P<b64>[A-Za-z0-9+/=\s]+))\)"
@@ -37,7 +39,7 @@ async def _extract_and_store_data_uri_images(db, text: str) -> str:
         # data URIs sometimes include newlines; remove whitespace for decode.
         b64 = "".join(b64.split())
         try:
-            data = base64.b64decode(b64)
+            data = await asyncio.to_thread(base64.b64decode, b64)
         except Exception:
             return match.group(0)
 
@@ -63,23 +65,79 @@ async def _extract_and_store_data_uri_images(db, text: str) -> str:
 
 logger = logging.getLogger(__name__)
 
+# Streamed draft text is coalesced into one broadcast per interval/size
+DRAFT_FLUSH_INTERVAL = 0.05  # seconds
+DRAFT_FLUSH_CHARS = 512
+
+
+class _DraftCoalescer:
+    """Accumulate agent draft chunks and broadcast them as fewer agent_draft events."""
+
+    def __init__(self, thread_id: int, agent_id: str) -> None:
+        self.thread_id = thread_id
+        self.agent_id = agent_id
+        self._parts: list[str] = []
+        self._size = 0
+        self._kind = "draft"
+        self._mode = "append"
+        self._timer: asyncio.TimerHandle | None = None
+        self._flush_task: asyncio.Task | None = None
+
+    async def add(self, text: str, kind: str, mode: str) -> None:
+        """Queue a chunk; flushes when the buffer grows large or the interval elapses."""
+        if self._parts and kind != self._kind:
+            await self.flush()
+        self._kind = kind
+        if mode == "replace":
+            # A snapshot supersedes anything still pending
+            self._parts = [text]
+            self._size = len(text)
+            self._mode = "replace"
+        else:
+            if not self._parts:
+                self._mode = mode
+            self._parts.append(text)
+            self._size += len(text)
+
+        if self._size >= DRAFT_FLUSH_CHARS:
+            await self.flush()
+        elif self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(DRAFT_FLUSH_INTERVAL, self._on_timer)
+
+    def _on_timer(self) -> None:
+        self._timer = None
+        self._flush_task = asyncio.ensure_future(self.flush())
+
+    async def flush(self) -> None:
+        """Broadcast any pending text immediately."""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if not self._parts:
+            return
+        text = "".join(self._parts)
+        self._parts = []
+        self._size = 0
+        await broadcast_event("agent_draft", {
+            "thread_id": self.thread_id,
+            "agent_id": self.agent_id,
+            "text": text,
+            "kind": self._kind,
+            "mode": self._mode,
+        })
+
 
-# Set up callback for agent requests
 async def _handle_agent_request(request_data):
     """Broadcast agent requests to UI."""
-    await broadcast_event("agent_request", request_data)
+    # Tool call inputs (e.g. whole files for writes) can be large
+    await broadcast_event("agent_request", request_data, large=True)
 
-set_request_callback(_handle_agent_request)
 
-
-# Set up whitelist checker
 async def _check_whitelist(title: str) -> bool:
     """Check if a tool call title is whitelisted."""
     db = await get_db()
     return await db.is_whitelisted(title)
 
-set_whitelist_checker(_check_whitelist)
-
 
 async def list_agents(request: web.Request) -> web.Response:
     """List available agents and their capabilities."""
@@ -99,18 +157,22 @@ async def list_agents(request: web.Request) -> web.Response:
 
 async def process_agent_response(thread_id: int, content: str, agent_id: str):
     """Background task to get agent response and broadcast it."""
+    drafts = _DraftCoalescer(thread_id, agent_id)
     try:
         # Status callback to broadcast agent activity
         async def status_callback(status):
+            # Activity updates are only for live viewers; skip building payloads
+            if not has_subscribers():
+                return
             if status.get("type") == "message_chunk":
-                await broadcast_event("agent_draft", {
-                    "thread_id": thread_id,
-                    "agent_id": agent_id,
-                    "text": status.get("text", ""),
-                    "kind": status.get("kind", "draft"),
-                    "mode": status.get("mode", "append"),
-                })
+                await drafts.add(
+                    status.get("text", ""),
+                    status.get("kind", "draft"),
+                    status.get("mode", "append"),
+                )
                 return
+            # Keep event order: pending draft text goes out before anything else
+            await drafts.flush()
             if status.get("type") == "thought_chunk":
                 await broadcast_event("agent_thought", {
                     "thread_id": thread_id,
@@ -134,6 +196,7 @@ async def process_agent_response(thread_id: int, content: str, agent_id: str):
         
         # Get multimodal response from ACP agent
         response = await send_message_multimodal(content, thread_id, status_callback)
+        await drafts.flush()
 
         # If a permission request timed out, stop and explain what happened.
         if response.get("cancelled"):
@@ -180,14 +243,13 @@ async def process_agent_response(thread_id: int, content: str, agent_id: str):
             "media_ids": media_ids,
         }
         
-        response_id = await db.create_interaction(agent_response)
-        response_interaction = await db.get_interaction(response_id)
+        response_interaction = await db.create_interaction(agent_response)
         
         # Don't fetch link previews for agent responses - they often contain
         # code snippets, documentation URLs, etc. that don't need previews
         
-        # Broadcast agent response
-        await broadcast_event("agent_response", response_interaction)
+        # Broadcast agent response (content blocks may carry inline base64 media)
+        await broadcast_event("agent_response", response_interaction, large=bool(media_ids))
 
         # Broadcast that agent is done (after response is available)
         await broadcast_event("agent_status", {
@@ -200,6 +262,7 @@ async def process_agent_response(thread_id: int, content: str, agent_id: str):
         
     except Exception as e:
         logger.error(f"Error processing agent response: {e}", exc_info=True)
+        await drafts.flush()
         
         # Broadcast error status
         await broadcast_event("agent_status", {
@@ -217,11 +280,16 @@ async def process_agent_response(thread_id: int, content: str, agent_id: str):
             "agent_id": agent_id,
             "thread_id": thread_id,
         }
-        response_id = await db.create_interaction(error_response)
-        response_interaction = await db.get_interaction(response_id)
+        response_interaction = await db.create_interaction(error_response)
         await broadcast_event("agent_response", response_interaction)
 
 
+def _decode_and_hash(payload: str) -> tuple[bytes, str]:
+    """Decode a base64 media payload and hash it in one worker-thread hop."""
+    data = base64.b64decode(payload)
+    return data, media_digest(data)
+
+
 async def _store_media_block(db, block: dict) -> int | None:
     """Store an image or file block in the media table, return media_id."""
     try:
@@ -231,10 +299,12 @@ async def _store_media_block(db, block: dict) -> int | None:
         
         # Get the data
         data = None
+        digest = None
         if "data" in block:
             encoding = block.get("encoding", "base64")
             if encoding == "base64":
-                data = base64.b64decode(block["data"])
+                # Multimodal payloads can be several MB; decode and hash off the event loop
+                data, digest = await asyncio.to_thread(_decode_and_hash, block["data"])
             else:
                 data = block["data"].encode() if isinstance(block["data"], str) else block["data"]
         elif "url" in block:
@@ -247,11 +317,18 @@ async def _store_media_block(db, block: dict) -> int | None:
         if not data:
             return None
         
+        # Reuse previously stored identical media (skips thumbnail re-encode)
+        if digest is None:
+            digest = await asyncio.to_thread(media_digest, data)
+        existing = await db.get_media_by_hash(digest, name)
+        if existing and existing["content_type"] == mime_type:
+            logger.info(f"Reusing agent media: {name} ({mime_type}) as media_id={existing['id']}")
+            return existing["id"]
+        
         # Generate thumbnail for images
         thumbnail = None
         if mime_type.startswith("image/"):
-            from .media import generate_thumbnail
-            thumbnail = generate_thumbnail(data, mime_type)
+            thumbnail = await asyncio.to_thread(generate_thumbnail, data, mime_type)
         
         # Store in database
         media_id = await db.create_media(
@@ -259,7 +336,8 @@ async def _store_media_block(db, block: dict) -> int | None:
             content_type=mime_type,
             data=data,
             thumbnail=thumbnail,
-            metadata={"source": "agent", "original_type": block_type}
+            metadata={"source": "agent", "original_type": block_type},
+            sha256=digest
         )
         
         logger.info(f"Stored agent media: {name} ({mime_type}) as media_id={media_id}")
@@ -275,8 +353,8 @@ async def send_message(request: web.Request) -> web.Response:
     agent_id = request.match_info["agent_id"]
     
     try:
-        data = await request.json()
-    except json.JSONDecodeError:
+        data = orjson.loads(await request.read())
+    except orjson.JSONDecodeError:
         return web.json_response({"error": "Invalid JSON"}, status=400)
 
     if "content" not in data:
@@ -295,8 +373,8 @@ async def send_message(request: web.Request) -> web.Response:
     if thread_id:
         user_msg["thread_id"] = thread_id
     
-    msg_id = await db.create_interaction(user_msg)
-    user_interaction = await db.get_interaction(msg_id)
+    user_interaction = await db.create_interaction(user_msg)
+    msg_id = user_interaction["id"]
     
     # Queue background task to fetch link previews
     queue_link_preview_fetch(msg_id, data["content"])
@@ -323,8 +401,8 @@ async def trigger_action(request: web.Request) -> web.Response:
     action_id = request.match_info["action_id"]
     
     try:
-        data = await request.json()
-    except json.JSONDecodeError:
+        data = orjson.loads(await request.read())
+    except orjson.JSONDecodeError:
         data = {}
 
     prompt = prompt_from_action(action_id, data.get("params"))
@@ -344,8 +422,8 @@ async def trigger_action(request: web.Request) -> web.Response:
 async def respond_to_agent_request(request: web.Request) -> web.Response:
     """Respond to a pending agent request (permission, choice, etc.)."""
     try:
-        data = await request.json()
-    except json.JSONDecodeError:
+        data = orjson.loads(await request.read())
+    except orjson.JSONDecodeError:
         return web.json_response({"error": "Invalid JSON"}, status=400)
     
     request_id = data.get("request_id")
@@ -373,8 +451,8 @@ async def get_whitelist(request: web.Request) -> web.Response:
 async def add_to_whitelist(request: web.Request) -> web.Response:
     """Add a pattern to the permission whitelist."""
     try:
-        data = await request.json()
-    except json.JSONDecodeError:
+        data = orjson.loads(await request.read())
+    except orjson.JSONDecodeError:
         return web.json_response({"error": "Invalid JSON"}, status=400)
     
     pattern = data.get("pattern")
@@ -398,8 +476,8 @@ async def add_to_whitelist(request: web.Request) -> web.Response:
 async def remove_from_whitelist(request: web.Request) -> web.Response:
     """Remove a pattern from the permission whitelist."""
     try:
-        data = await request.json()
-    except json.JSONDecodeError:
+        data = orjson.loads(await request.read())
+    except orjson.JSONDecodeError:
         return web.json_response({"error": "Invalid JSON"}, status=400)
     
     pattern = data.get("pattern")
@@ -419,6 +497,10 @@ async def remove_from_whitelist(request: web.Request) -> web.Response:
 
 def setup_routes(app: web.Application) -> None:
     """Set up agent routes."""
+    # Wire ACP callbacks here rather than at import time
+    set_request_callback(_handle_agent_request)
+    set_whitelist_checker(_check_whitelist)
+    
     app.router.add_get("/agents", list_agents)
     app.router.add_post("/agent/{agent_id}/message", send_message)
     app.router.add_post("/agent/{agent_id}/action/{action_id}", trigger_action)
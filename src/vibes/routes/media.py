@@ -1,6 +1,9 @@
 """Media upload and serving route handlers."""
 
+import asyncio
+import hashlib
 import io
+from contextlib import aclosing
 from aiohttp import web
 from PIL import Image
 from ..db import get_db
@@ -8,15 +11,21 @@ from ..db import get_db
 MAX_THUMBNAIL_SIZE = 400  # Smaller thumbnails for chat display
 THUMBNAIL_QUALITY = 75
 MAX_UPLOAD_SIZE = 10 * 1024 * 1024  # 10MB
+MULTIPART_OVERHEAD = 64 * 1024  # Boundaries and part headers on top of the file bytes
+MEDIA_CACHE_CONTROL = "public, max-age=31536000, immutable"  # Media is immutable by id
 
 
-def generate_thumbnail(data: bytes, content_type: str) -> bytes | None:
-    """Generate a thumbnail for an image."""
+def generate_thumbnail_and_meta(data: bytes, content_type: str) -> tuple[bytes | None, dict]:
+    """Generate a thumbnail for an image and return it with the original dimensions."""
     if not content_type.startswith("image/"):
-        return None
+        return None, {}
     
     try:
         img = Image.open(io.BytesIO(data))
+        meta = {"width": img.size[0], "height": img.size[1]}
+        
+        # Let JPEG decode straight at a reduced scale (no-op for other formats)
+        img.draft("RGB", (MAX_THUMBNAIL_SIZE, MAX_THUMBNAIL_SIZE))
         
         # Convert to RGB if necessary (for PNG with transparency, etc.)
         if img.mode in ("RGBA", "P"):
@@ -24,18 +33,42 @@ def generate_thumbnail(data: bytes, content_type: str) -> bytes | None:
         
         # Resize if larger than max size
         if max(img.size) > MAX_THUMBNAIL_SIZE:
-            img.thumbnail((MAX_THUMBNAIL_SIZE, MAX_THUMBNAIL_SIZE), Image.Resampling.LANCZOS)
+            # reducing_gap box-reduces first so LANCZOS only runs on a small image
+            img.thumbnail((MAX_THUMBNAIL_SIZE, MAX_THUMBNAIL_SIZE), Image.Resampling.LANCZOS, reducing_gap=2.0)
         
         # Save as JPEG
         output = io.BytesIO()
         img.save(output, format="JPEG", quality=THUMBNAIL_QUALITY)
-        return output.getvalue()
+        return output.getvalue(), meta
     except Exception:
-        return None
+        return None, {}
+
+
+def generate_thumbnail(data: bytes, content_type: str) -> bytes | None:
+    """Generate a thumbnail for an image."""
+    return generate_thumbnail_and_meta(data, content_type)[0]
+
+
+def media_digest(data: bytes) -> str:
+    """Hash media bytes for deduplication (hashlib releases the GIL, so run it in a thread)."""
+    return hashlib.sha256(data).hexdigest()
+
+
+def _cached_response(request: web.Request, etag: str, data: bytes, content_type: str) -> web.Response:
+    """Build a long-lived cacheable response, answering 304 on a matching ETag."""
+    headers = {"ETag": etag, "Cache-Control": MEDIA_CACHE_CONTROL}
+    if request.headers.get("If-None-Match") == etag:
+        return web.Response(status=304, headers=headers)
+    return web.Response(body=data, content_type=content_type, headers=headers)
 
 
 async def upload_media(request: web.Request) -> web.Response:
     """Handle media file upload."""
+    # Reject declared oversize bodies before reading a byte; the exact file
+    # size limit is enforced while streaming the part below
+    if request.content_length is not None and request.content_length > MAX_UPLOAD_SIZE + MULTIPART_OVERHEAD:
+        return web.json_response({"error": "File too large"}, status=413)
+    
     reader = await request.multipart()
     
     field = await reader.next()
@@ -59,26 +92,31 @@ async def upload_media(request: web.Request) -> web.Response:
     
     data = b"".join(chunks)
     
-    # Generate thumbnail for images
-    thumbnail = generate_thumbnail(data, content_type)
-    
-    # Extract metadata
-    metadata = {"size": len(data)}
-    if content_type.startswith("image/"):
-        try:
-            img = Image.open(io.BytesIO(data))
-            metadata["width"] = img.size[0]
-            metadata["height"] = img.size[1]
-        except Exception:
-            pass
-    
+    # Identical bytes were already stored under this name: reuse that row instead
+    # of re-encoding the thumbnail and storing a second copy of the blob
     db = await get_db()
+    digest = await asyncio.to_thread(media_digest, data)
+    existing = await db.get_media_by_hash(digest, filename)
+    if existing and existing["content_type"] == content_type:
+        return web.json_response({
+            "id": existing["id"],
+            "filename": existing["filename"],
+            "content_type": existing["content_type"],
+            "metadata": existing["metadata"]
+        }, status=201)
+    
+    # Generate thumbnail and extract dimensions for images in one decode;
+    # Pillow releases the GIL, so a worker thread keeps the event loop responsive
+    thumbnail, image_meta = await asyncio.to_thread(generate_thumbnail_and_meta, data, content_type)
+    metadata = {"size": len(data), **image_meta}
+    
     media_id = await db.create_media(
         filename=filename,
         content_type=content_type,
         data=data,
         thumbnail=thumbnail,
-        metadata=metadata
+        metadata=metadata,
+        sha256=digest
     )
     
     return web.json_response({
@@ -94,13 +132,29 @@ async def get_media(request: web.Request) -> web.Response:
     media_id = int(request.match_info["id"])
     
     db = await get_db()
-    result = await db.get_media_data(media_id)
+    info = await db.get_media_info(media_id)
     
-    if not result:
+    if not info:
         return web.json_response({"error": "Media not found"}, status=404)
     
-    content_type, data = result
-    return web.Response(body=data, content_type=content_type)
+    content_type, size = info
+    etag = f'W/"{media_id}-{size}"'
+    headers = {"ETag": etag, "Cache-Control": MEDIA_CACHE_CONTROL}
+    if request.headers.get("If-None-Match") == etag:
+        return web.Response(status=304, headers=headers)
+    
+    # Stream the blob out in chunks instead of loading it into one bytes object
+    response = web.StreamResponse(headers=headers)
+    response.content_type = content_type
+    response.content_length = size
+    await response.prepare(request)
+    if request.method != "HEAD":
+        # aclosing releases the stream's connection even if the client goes away
+        async with aclosing(db.iter_media_data(media_id)) as chunks:
+            async for chunk in chunks:
+                await response.write(chunk)
+    await response.write_eof()
+    return response
 
 
 async def get_media_thumbnail(request: web.Request) -> web.Response:
@@ -111,13 +165,11 @@ async def get_media_thumbnail(request: web.Request) -> web.Response:
     result = await db.get_media_thumbnail(media_id)
     
     if not result:
-        # Fall back to original if no thumbnail
-        result = await db.get_media_data(media_id)
-        if not result:
-            return web.json_response({"error": "Media not found"}, status=404)
+        # Fall back to streaming the original if no thumbnail
+        return await get_media(request)
     
     content_type, data = result
-    return web.Response(body=data, content_type=content_type)
+    return _cached_response(request, f'W/"{media_id}-thumb-{len(data)}"', data, content_type)
 
 
 async def get_media_info(request: web.Request) -> web.Response:
@@ -1,6 +1,6 @@
 """Post and reply route handlers."""
 
-import json
+import orjson
 from aiohttp import web
 from ..db import get_db
 from ..opengraph import queue_link_preview_fetch
@@ -10,8 +10,8 @@ from .sse import broadcast_event
 async def create_post(request: web.Request) -> web.Response:
     """Create a new post (text, link, image, file)."""
     try:
-        data = await request.json()
-    except json.JSONDecodeError:
+        data = orjson.loads(await request.read())
+    except orjson.JSONDecodeError:
         return web.json_response({"error": "Invalid JSON"}, status=400)
 
     if "content" not in data:
@@ -24,13 +24,10 @@ async def create_post(request: web.Request) -> web.Response:
     }
 
     db = await get_db()
-    post_id = await db.create_interaction(post_data)
-    
-    # Fetch the created post to return
-    post = await db.get_interaction(post_id)
+    post = await db.create_interaction(post_data)
     
     # Queue background task to fetch link previews
-    queue_link_preview_fetch(post_id, data["content"])
+    queue_link_preview_fetch(post["id"], data["content"])
     
     # Broadcast to SSE clients
     await broadcast_event("new_post", post)
@@ -41,8 +38,8 @@ async def create_post(request: web.Request) -> web.Response:
 async def create_reply(request: web.Request) -> web.Response:
     """Reply to an existing thread."""
     try:
-        data = await request.json()
-    except json.JSONDecodeError:
+        data = orjson.loads(await request.read())
+    except orjson.JSONDecodeError:
         return web.json_response({"error": "Invalid JSON"}, status=400)
 
     if "content" not in data:
@@ -64,11 +61,10 @@ async def create_reply(request: web.Request) -> web.Response:
         "media_ids": data.get("media_ids", []),
     }
 
-    reply_id = await db.create_interaction(reply_data)
-    reply = await db.get_interaction(reply_id)
+    reply = await db.create_interaction(reply_data)
     
     # Queue background task to fetch link previews
-    queue_link_preview_fetch(reply_id, data["content"])
+    queue_link_preview_fetch(reply["id"], data["content"])
     
     # Broadcast to SSE clients
     await broadcast_event("new_reply", reply)
@@ -103,33 +99,44 @@ async def get_timeline(request: web.Request) -> web.Response:
     db = await get_db()
     posts = await db.get_timeline(limit=limit, before_id=before_id)
     
-    # Check if there are older posts
-    has_more = len(posts) == limit and posts[0]["id"] > 1
+    # Check if there are older posts; only a full page can have more
+    has_more = len(posts) == limit and await db.has_interactions_before(posts[0]["id"])
     
     return web.json_response({
         "posts": posts,
         "limit": limit,
-        "has_more": has_more
+        "has_more": has_more,
+        "next_cursor": posts[0]["id"] if posts else None
     })
 
 
 async def get_hashtag(request: web.Request) -> web.Response:
-    """Get posts containing a specific hashtag."""
+    """Get posts containing a specific hashtag (newest first, load older with before_id)."""
     hashtag = request.match_info["hashtag"]
     limit = int(request.query.get("limit", 50))
-    offset = int(request.query.get("offset", 0))
+    before_id = request.query.get("before")
     
     # Clamp limit
     limit = max(1, min(100, limit))
     
+    if before_id:
+        try:
+            before_id = int(before_id)
+        except ValueError:
+            return web.json_response({"error": "Invalid 'before' parameter"}, status=400)
+    
     db = await get_db()
-    posts = await db.get_posts_by_hashtag(hashtag, limit=limit, offset=offset)
+    posts = await db.get_posts_by_hashtag(hashtag, limit=limit, before_id=before_id)
+    
+    # A short page is the last one, so don't hand out a cursor for an empty fetch
+    has_more = len(posts) == limit
     
     return web.json_response({
         "hashtag": hashtag,
         "posts": posts,
         "limit": limit,
-        "offset": offset
+        "has_more": has_more,
+        "next_cursor": posts[-1]["id"] if has_more else None
     })
 
 
@@ -1,7 +1,10 @@
 """Server-Sent Events route handler."""
 
 import asyncio
-import json
+import logging
+import orjson
+from collections import deque
+from itertools import islice
 from typing import Any
 from aiohttp import web
 from aiohttp.client_exceptions import ClientConnectionResetError
@@ -9,53 +12,156 @@ from aiohttp.client_exceptions import ClientConnectionResetError
 from ..acp_client import stop_agent, start_agent
 from ..config import get_config
 
-# Connected SSE clients
-_clients: set[asyncio.Queue] = set()
-_restart_task: asyncio.Task | None = None
+logger = logging.getLogger(__name__)
+
+# Shared ring of encoded frames; each client reads forward from its own
+# sequence number, so a broadcast is one append regardless of client count.
+# Frames every client has read are dropped right away, so the ring only
+# holds what the slowest client still owes (agent frames can carry inline
+# media). Slow clients never block producers: they lose the oldest frames
+# and get a resync event instead.
+BUFFER_SIZE = 256
+RESYNC_FRAME = b"event: resync\ndata: {}\n\n"
+HEARTBEAT_FRAME = b": heartbeat\n\n"
+HEARTBEAT_INTERVAL = 30.0  # Seconds between keepalive comments
+_buf: deque[bytes] = deque(maxlen=BUFFER_SIZE)
+_seq = 0  # Total frames ever appended to _buf
+_cursors: dict[object, int] = {}  # Connected client -> last sequence number it read
+_wakeup: asyncio.Event | None = None  # Created per loop while clients are connected
+_wake_pending = False  # A _wake_readers call is scheduled for this tick
+_client_count = 0
+
+# One long-lived supervisor restarts the agent after clients stay away;
+# connects and disconnects only flip these events.
+_active: asyncio.Event | None = None  # Set while any client is connected
+_idle: asyncio.Event | None = None  # Set while no client is connected
+_supervisor_task: asyncio.Task | None = None
+# One shared ticker pushes heartbeats through the ring for every client
+_heartbeat_task: asyncio.Task | None = None
+
+
+# Encoded "event: ...\ndata: " prefixes; event types are a small fixed set
+_EVENT_PREFIX: dict[str, bytes] = {}
+
+
+def _encode_payload(data: Any) -> bytes:
+    """Serialize an event payload to UTF-8 JSON bytes (bytes pass through as-is)."""
+    if isinstance(data, (bytes, bytearray, memoryview)):
+        return bytes(data)
+    return orjson.dumps(data, option=orjson.OPT_NON_STR_KEYS)
+
+
+async def broadcast_event(event_type: str, data: Any, large: bool = False) -> None:
+    """Broadcast an event to all connected SSE clients.
+
+    Set ``large`` for payloads that may be big (inline media, tool inputs) so
+    serialization runs in a worker thread instead of blocking the event loop.
+    ``data`` may also be already-encoded JSON bytes, which are sent verbatim.
+    """
+    if not _client_count:
+        return
+    if large:
+        payload = await asyncio.to_thread(_encode_payload, data)
+    else:
+        payload = _encode_payload(data)
+    # Frame is built once as bytes and written verbatim to every client
+    prefix = _EVENT_PREFIX.get(event_type)
+    if prefix is None:
+        prefix = _EVENT_PREFIX[event_type] = f"event: {event_type}\ndata: ".encode()
+    _publish(b"".join((prefix, payload, b"\n\n")))
+
+
+def _publish(frame: bytes) -> None:
+    """Append a frame to the ring and schedule a reader wakeup."""
+    global _seq, _wake_pending
+    _buf.append(frame)
+    _seq += 1
+    
+    # Wake readers once at the end of this loop tick, so a burst of broadcasts
+    # costs one pass over the waiters and reaches each client as one write
+    if _wakeup is not None and not _wake_pending:
+        _wake_pending = True
+        asyncio.get_running_loop().call_soon(_wake_readers)
 
 
-async def broadcast_event(event_type: str, data: Any) -> None:
-    """Broadcast an event to all connected SSE clients."""
-    message = f"event: {event_type}\ndata: {json.dumps(data)}\n\n"
-    disconnected = set()
-    
-    for queue in _clients:
-        try:
-            queue.put_nowait(message)
-        except asyncio.QueueFull:
-            disconnected.add(queue)
-    
-    # Clean up disconnected clients
-    _clients.difference_update(disconnected)
+def _wake_readers() -> None:
+    """Wake every waiting client; clearing right away doesn't un-wake them."""
+    global _wake_pending
+    _wake_pending = False
+    if _wakeup is not None:
+        _wakeup.set()
+        _wakeup.clear()
 
 
-async def _restart_agent_after_disconnect(delay_s: int) -> None:
-    try:
-        await asyncio.sleep(delay_s)
-        if _clients:
-            return
-        await stop_agent()
-        await start_agent()
-    except asyncio.CancelledError:
-        raise
-
-
-def _schedule_restart_if_needed() -> None:
-    global _restart_task
-    if _clients:
-        if _restart_task and not _restart_task.done():
-            _restart_task.cancel()
-        _restart_task = None
-        return
+def has_subscribers() -> bool:
+    """Return True if at least one SSE client is connected."""
+    return _client_count > 0
 
-    if _restart_task and not _restart_task.done():
-        return
 
-    delay_s = get_config().disconnect_timeout
-    if delay_s <= 0:
+def _trim_consumed() -> None:
+    """Drop frames that every connected client has already read."""
+    if not _cursors:
         return
+    for _ in range(min(_cursors.values()) - (_seq - len(_buf))):
+        _buf.popleft()
 
-    _restart_task = asyncio.create_task(_restart_agent_after_disconnect(delay_s))
+
+def _frames_since(last_seq: int) -> list[bytes]:
+    """Return buffered frames appended after last_seq (oldest ones may be gone)."""
+    count = min(_seq - last_seq, len(_buf))
+    return list(islice(_buf, len(_buf) - count, None))
+
+
+async def _restart_supervisor(active: asyncio.Event, idle: asyncio.Event) -> None:
+    """Restart the agent once all clients have been gone for disconnect_timeout."""
+    while True:
+        await idle.wait()
+        delay_s = get_config().disconnect_timeout
+        if delay_s > 0:
+            try:
+                await asyncio.wait_for(active.wait(), timeout=delay_s)
+            except asyncio.TimeoutError:
+                try:
+                    await stop_agent()
+                    await start_agent()
+                except Exception as e:
+                    logger.error("Agent restart after disconnect failed: %s", e, exc_info=True)
+        # Rearm only after a client comes back
+        await active.wait()
+
+
+async def _heartbeat_ticker() -> None:
+    """Send a keepalive comment to all connected clients every HEARTBEAT_INTERVAL."""
+    while True:
+        await asyncio.sleep(HEARTBEAT_INTERVAL)
+        if _client_count:
+            _publish(HEARTBEAT_FRAME)
+
+
+def _update_activity() -> None:
+    """Flip the supervisor's events to match the current client count."""
+    global _active, _idle, _supervisor_task, _heartbeat_task
+    if _supervisor_task is None or _supervisor_task.done():
+        _active, _idle = asyncio.Event(), asyncio.Event()
+        _supervisor_task = asyncio.create_task(_restart_supervisor(_active, _idle))
+    if _heartbeat_task is None or _heartbeat_task.done():
+        _heartbeat_task = asyncio.create_task(_heartbeat_ticker())
+    if _client_count:
+        _idle.clear()
+        _active.set()
+    else:
+        _active.clear()
+        _idle.set()
+
+
+async def _stop_background_tasks(app: web.Application) -> None:
+    """Cancel the heartbeat ticker and restart supervisor, then await them."""
+    global _supervisor_task, _heartbeat_task
+    tasks = [task for task in (_supervisor_task, _heartbeat_task) if task is not None]
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    _supervisor_task = _heartbeat_task = None
 
 
 async def sse_stream(request: web.Request) -> web.StreamResponse:
@@ -72,32 +178,49 @@ async def sse_stream(request: web.Request) -> web.StreamResponse:
     )
     await response.prepare(request)
     
-    # Create client queue
-    queue: asyncio.Queue = asyncio.Queue(maxsize=100)
-    _clients.add(queue)
-    _schedule_restart_if_needed()
+    # Register client; only frames broadcast from now on are delivered
+    global _client_count, _wakeup, _wake_pending
+    if _wakeup is None:
+        _wakeup = asyncio.Event()
+        _wake_pending = False
+    wakeup = _wakeup
+    _client_count += 1
+    client = object()
+    last_seq = _cursors[client] = _seq
+    _update_activity()
     
     try:
         # Send initial connection event
         await response.write(b"event: connected\ndata: {}\n\n")
         
-        # Heartbeat and message loop
+        # Message loop; heartbeats arrive through the ring like any other frame
         while True:
             try:
-                # Wait for message with timeout for heartbeat
-                message = await asyncio.wait_for(queue.get(), timeout=30.0)
-                await response.write(message.encode())
-            except asyncio.TimeoutError:
-                # Send heartbeat
-                await response.write(b": heartbeat\n\n")
+                if last_seq == _seq:
+                    await wakeup.wait()
+                    continue
+                # Drain everything pending in a single write
+                frames = _frames_since(last_seq)
+                if _seq - last_seq > len(frames):
+                    # Fell behind the ring: oldest frames are gone, have the client reload
+                    frames.insert(0, RESYNC_FRAME)
+                last_seq = _cursors[client] = _seq
+                _trim_consumed()
+                await response.write(b"".join(frames))
             except asyncio.CancelledError:
                 break
     except (ConnectionResetError, ConnectionAbortedError, BrokenPipeError, ClientConnectionResetError):
         # Client disconnected, this is normal for SSE
         pass
     finally:
-        _clients.discard(queue)
-        _schedule_restart_if_needed()
+        _client_count -= 1
+        del _cursors[client]
+        _trim_consumed()
+        if not _client_count:
+            # Nobody left to read: drop retained frames and the loop-bound event
+            _buf.clear()
+            _wakeup = None
+        _update_activity()
     
     return response
 
@@ -105,3 +228,4 @@ async def sse_stream(request: web.Request) -> web.StreamResponse:
 def setup_routes(app: web.Application) -> None:
     """Set up SSE routes."""
     app.router.add_get("/sse/stream", sse_stream)
+    app.on_cleanup.append(_stop_background_tasks)
@@ -38,8 +38,12 @@ export async function getTimeline(limit = 10, beforeId = null) {
 /**
  * Get posts by hashtag
  */
-export async function getPostsByHashtag(hashtag, limit = 50, offset = 0) {
-    return request(`/hashtag/${encodeURIComponent(hashtag)}?limit=${limit}&offset=${offset}`);
+export async function getPostsByHashtag(hashtag, limit = 50, beforeId = null) {
+    let url = `/hashtag/${encodeURIComponent(hashtag)}?limit=${limit}`;
+    if (beforeId) {
+        url += `&before=${beforeId}`;
+    }
+    return request(url);
 }
 
 /**
@@ -237,6 +241,10 @@ export class SSEClient {
         this.eventSource.addEventListener('agent_draft', (e) => {
             this.onEvent('agent_draft', JSON.parse(e.data));
         });
+
+        this.eventSource.addEventListener('resync', () => {
+            this.onEvent('resync', {});
+        });
     }
     
     scheduleReconnect() {
@@ -1223,6 +1223,12 @@ function App() {
         
         const sse = new SSEClient(
             (eventType, data) => {
+                // Server dropped events we missed; reload the current view
+                if (eventType === 'resync') {
+                    loadPosts(currentHashtag);
+                    return;
+                }
+
                 // Handle agent status updates
                 if (eventType === 'agent_status') {
                     console.log('Agent status:', data);
@@ -1,96 +1,104 @@
 """Async task queue for background processing."""
 
 import asyncio
+import functools
+import inspect
 import logging
+from concurrent.futures import ThreadPoolExecutor
 from typing import Callable
 
 logger = logging.getLogger(__name__)
 
-# Background task queue
+# Background task queue, shared by all workers so an idle worker always
+# picks up the next task (no lock contention on a single-threaded loop)
 _task_queue: asyncio.Queue | None = None
 _workers: list[asyncio.Task] = []
 _running = False
+_SHUTDOWN = object()  # Queued behind pending tasks, one per worker, to stop them
+_pool: ThreadPoolExecutor | None = None  # Runs plain (non-async) task functions
 
 
-async def _worker(worker_id: int):
-    """Worker coroutine that processes tasks from the queue."""
-    global _task_queue
-    logger.info(f"Task worker {worker_id} started")
+async def _worker(worker_id: int, queue: asyncio.Queue):
+    """Worker coroutine that processes tasks from the shared queue."""
+    logger.info("Task worker %d started", worker_id)
     
-    while _running:
+    while True:
         try:
-            # Wait for a task with timeout to allow clean shutdown
-            try:
-                task_func, args, kwargs = await asyncio.wait_for(
-                    _task_queue.get(), timeout=1.0
-                )
-            except asyncio.TimeoutError:
-                continue
+            item = await queue.get()
+            if item is _SHUTDOWN:
+                break
             
+            task_func, args, kwargs = item
             try:
-                await task_func(*args, **kwargs)
+                if inspect.iscoroutinefunction(task_func):
+                    await task_func(*args, **kwargs)
+                else:
+                    # Keep blocking/CPU-bound work off the event loop
+                    await asyncio.get_running_loop().run_in_executor(
+                        _pool, functools.partial(task_func, *args, **kwargs)
+                    )
             except Exception as e:
-                logger.error(f"Task error: {e}", exc_info=True)
-            finally:
-                _task_queue.task_done()
+                logger.error("Task error: %s", e, exc_info=True)
                 
         except asyncio.CancelledError:
             break
         except Exception as e:
-            logger.error(f"Worker {worker_id} error: {e}", exc_info=True)
+            logger.error("Worker %d error: %s", worker_id, e, exc_info=True)
     
-    logger.info(f"Task worker {worker_id} stopped")
+    logger.info("Task worker %d stopped", worker_id)
 
 
 async def start_task_queue(num_workers: int = 3):
     """Start the background task queue with workers."""
-    global _task_queue, _workers, _running
+    global _task_queue, _workers, _running, _pool
     
+    # At most one executor job per worker can be in flight
+    _pool = ThreadPoolExecutor(max_workers=num_workers, thread_name_prefix="vibes-task")
     _task_queue = asyncio.Queue()
     _running = True
     
     for i in range(num_workers):
-        worker = asyncio.create_task(_worker(i))
+        worker = asyncio.create_task(_worker(i, _task_queue))
         _workers.append(worker)
     
-    logger.info(f"Task queue started with {num_workers} workers")
+    logger.info("Task queue started with %d workers", num_workers)
 
 
 async def stop_task_queue():
     """Stop the background task queue and all workers."""
-    global _running, _workers
+    global _running, _workers, _pool
     
     _running = False
     
-    # Wait for queue to drain (with timeout)
-    if _task_queue and not _task_queue.empty():
-        try:
-            await asyncio.wait_for(_task_queue.join(), timeout=5.0)
-        except asyncio.TimeoutError:
-            logger.warning("Task queue drain timeout, some tasks may be lost")
-    
-    # Cancel all workers
-    for worker in _workers:
-        worker.cancel()
+    # Workers finish what is already queued, then each exits on a sentinel
+    if _task_queue is not None:
+        for _ in _workers:
+            _task_queue.put_nowait(_SHUTDOWN)
     
     if _workers:
-        await asyncio.gather(*_workers, return_exceptions=True)
+        _, pending = await asyncio.wait(_workers, timeout=5.0)
+        if pending:
+            logger.warning("Task queue drain timeout, some tasks may be lost")
+            for worker in pending:
+                worker.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
     
     _workers.clear()
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
     logger.info("Task queue stopped")
 
 
 def enqueue(task_func: Callable, *args, **kwargs):
     """Add a task to the background queue."""
-    global _task_queue, _running
-    
     if _task_queue is None or not _running:
-        logger.warning(f"Task queue not running (queue={_task_queue}, running={_running}), task dropped")
+        logger.warning("Task queue not running (queue=%s, running=%s), task dropped", _task_queue, _running)
         return False
     
     try:
         _task_queue.put_nowait((task_func, args, kwargs))
-        logger.info(f"Task enqueued: {task_func.__name__}")
+        logger.info("Task enqueued: %s", task_func.__name__)
         return True
     except asyncio.QueueFull:
         logger.warning("Task queue full, task dropped")
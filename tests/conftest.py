@@ -1,16 +1,14 @@
 """Pytest configuration and fixtures."""
 
+import copy
 import pytest
 import pytest_asyncio
-import tempfile
-import os
 
 
 @pytest.fixture
-def temp_db_path():
-    """Create a temporary database path."""
-    with tempfile.TemporaryDirectory() as tmpdir:
-        yield os.path.join(tmpdir, "test.db")
+def temp_db_path(tmp_path):
+    """Create a temporary database path (unique per test and per xdist worker)."""
+    return str(tmp_path / "test.db")
 
 
 @pytest_asyncio.fixture
@@ -19,6 +17,8 @@ async def db(temp_db_path):
     from vibes.db import Database
     database = Database(temp_db_path)
     await database.connect()
+    # Test databases are throwaway, so skip fsync on every commit
+    await database._connection.execute("PRAGMA synchronous = OFF")
     try:
         yield database
     finally:
@@ -37,16 +37,31 @@ async def posts_test_client(temp_db_path):
     app = web.Application()
     posts.setup_routes(app)
 
-    await init_db(temp_db_path)
+    database = await init_db(temp_db_path, readers=2)
+    await database._connection.execute("PRAGMA synchronous = OFF")
     try:
-        async with TestClient(TestServer(app)) as client:
-            with patch('vibes.routes.posts.queue_link_preview_fetch'):
-                with patch('vibes.routes.posts.broadcast_event', new_callable=AsyncMock):
-                    yield client
+        with patch('vibes.routes.posts.queue_link_preview_fetch'), \
+                patch('vibes.routes.posts.broadcast_event', new_callable=AsyncMock):
+            async with TestClient(TestServer(app)) as client:
+                yield client
     finally:
         await close_db()
 
 
+@pytest.fixture
+def seed_posts():
+    """Insert posts straight into the global database, skipping the HTTP round-trip."""
+    from vibes.db import get_db
+
+    async def _seed(n, prefix="Post"):
+        db = await get_db()
+        return await db.create_interactions_bulk([
+            {"type": "post", "content": f"{prefix} {i}", "media_ids": []}
+            for i in range(n)
+        ])
+    return _seed
+
+
 @pytest_asyncio.fixture
 async def media_test_client(temp_db_path):
     """Provide a test client with media routes configured."""
@@ -58,7 +73,8 @@ async def media_test_client(temp_db_path):
     app = web.Application()
     media.setup_routes(app)
 
-    await init_db(temp_db_path)
+    database = await init_db(temp_db_path)
+    await database._connection.execute("PRAGMA synchronous = OFF")
     try:
         async with TestClient(TestServer(app)) as client:
             yield client
@@ -66,38 +82,92 @@ async def media_test_client(temp_db_path):
         await close_db()
 
 
+@pytest.fixture
+def mock_writer():
+    """Provide a writer standing in for the agent's stdin pipe (see fake_reader for stdout)."""
+    from unittest.mock import AsyncMock, MagicMock
+    writer = AsyncMock()
+    writer.writelines = MagicMock()
+    writer.drain = AsyncMock()
+    return writer
+
+
+@pytest.fixture(scope="session")
+def png_bytes():
+    """Encode solid-color PNGs once per session, keyed by (mode, size, color)."""
+    import functools
+    import io
+    from PIL import Image
+
+    @functools.lru_cache(maxsize=None)
+    def _make(mode, size, color):
+        buf = io.BytesIO()
+        Image.new(mode, size, color=color).save(buf, format='PNG', compress_level=1)
+        return buf.getvalue()
+    return _make
+
+
+@pytest.fixture
+def fake_reader():
+    """Build a real StreamReader pre-fed with the given agent output lines."""
+    import asyncio
+
+    def _make(lines):
+        reader = asyncio.StreamReader()
+        for line in lines:
+            reader.feed_data(line)
+        reader.feed_eof()
+        return reader
+    return _make
+
+
+# Sample payloads are built once; fixtures hand out copies so tests may mutate them
+_SAMPLE_POST = {
+    "type": "post",
+    "content": "Hello world! #test",
+    "media_ids": [],
+    "link_previews": []
+}
+
+_SAMPLE_AGENT_RESPONSE = {
+    "type": "agent_response",
+    "content": "I can help you with that.",
+    "thread_id": 1,
+    "agent_id": "test-agent"
+}
+
+_SAMPLE_MEDIA = {
+    "filename": "test.png",
+    "content_type": "image/png",
+    "data": b'\x89PNG\r\n\x1a\n' + b'\x00' * 100,  # Minimal PNG-like data
+    "thumbnail": b'\xff\xd8\xff' + b'\x00' * 50,  # Minimal JPEG-like data
+    "metadata": {"width": 100, "height": 100}
+}
+
+
 @pytest.fixture
 def sample_post_data():
     """Sample post data for testing."""
-    return {
-        "type": "post",
-        "content": "Hello world! #test",
-        "media_ids": [],
-        "link_previews": []
-    }
+    return copy.deepcopy(_SAMPLE_POST)
 
 
 @pytest.fixture
 def sample_agent_response_data():
     """Sample agent response data for testing."""
-    return {
-        "type": "agent_response",
-        "content": "I can help you with that.",
-        "thread_id": 1,
-        "agent_id": "test-agent"
-    }
+    return copy.deepcopy(_SAMPLE_AGENT_RESPONSE)
 
 
 @pytest.fixture
 def sample_media_data():
     """Sample media data for testing."""
-    return {
-        "filename": "test.png",
-        "content_type": "image/png",
-        "data": b'\x89PNG\r\n\x1a\n' + b'\x00' * 100,  # Minimal PNG-like data
-        "thumbnail": b'\xff\xd8\xff' + b'\x00' * 50,  # Minimal JPEG-like data
-        "metadata": {"width": 100, "height": 100}
-    }
+    return copy.deepcopy(_SAMPLE_MEDIA)
+
+
+def pytest_addoption(parser):
+    parser.addoption(
+        "--runintegration", action="store_true", default=False,
+        help="run tests marked as integration (aiohttp test server + database)"
+    )
 
 
 # Configure pytest-asyncio
@@ -105,3 +175,15 @@ def pytest_configure(config):
     config.addinivalue_line(
         "markers", "asyncio: mark test as an asyncio test."
     )
+    config.addinivalue_line(
+        "markers", "integration: test spins up a test server; needs --runintegration."
+    )
+
+
+def pytest_collection_modifyitems(config, items):
+    if config.getoption("--runintegration"):
+        return
+    skip_integration = pytest.mark.skip(reason="needs --runintegration")
+    for item in items:
+        if "integration" in item.keywords:
+            item.add_marker(skip_integration)
@@ -24,6 +24,19 @@ class TestAcpClient:
         assert id2 == 2
         assert id3 == 3
 
+    def test_reset_state_gives_fresh_state(self):
+        """Test that reset_state replaces state rather than mutating it."""
+        state = acp_client.get_state()
+        state.session_id = "stale"
+        state.pending_requests[1] = object()
+        
+        acp_client.reset_state()
+        fresh = acp_client.get_state()
+        assert fresh is not state
+        assert fresh.session_id is None
+        assert fresh.pending_requests == {}
+        assert not fresh.request_lock.locked()
+
     def test_is_agent_running_false(self):
         """Test is_agent_running when no agent."""
         assert acp_client.is_agent_running() is False
@@ -73,6 +86,64 @@ class TestAcpClient:
         result = await acp_client._read_frame(mock_reader)
         assert result == []
 
+    @pytest.mark.asyncio
+    async def test_ensure_agent_raises_read_limit(self):
+        """Test that the agent pipe accepts frames larger than asyncio's 64 KiB default."""
+        mock_proc = MagicMock()
+        mock_proc.returncode = None
+        with patch.object(acp_client.shutil, 'which', return_value='/usr/bin/agent'), \
+             patch.object(acp_client.asyncio, 'create_subprocess_exec', new_callable=AsyncMock, return_value=mock_proc) as mock_exec, \
+             patch.object(acp_client, '_send_request', new_callable=AsyncMock, return_value={"sessionId": "s1"}):
+            await acp_client._ensure_agent()
+        
+        assert mock_exec.call_args.kwargs["limit"] == acp_client.AGENT_READ_LIMIT
+        assert acp_client.get_state().session_id == "s1"
+
+    @pytest.mark.asyncio
+    async def test_read_frame_large_line(self):
+        """Test reading a frame well past the default StreamReader limit."""
+        reader = asyncio.StreamReader(limit=acp_client.AGENT_READ_LIMIT)
+        payload = {"jsonrpc": "2.0", "id": 1, "result": {"data": "x" * 200_000}}
+        reader.feed_data(json.dumps(payload).encode() + b'\n')
+        
+        result = await acp_client._read_frame(reader)
+        assert result == [payload]
+
+    @pytest.mark.asyncio
+    async def test_read_frame_skip_updates(self):
+        """Test that session/update notifications can be dropped unparsed."""
+        update = {"jsonrpc": "2.0", "method": "session/update", "params": {"update": {}}}
+        mock_reader = AsyncMock()
+        mock_reader.readline = AsyncMock(return_value=json.dumps(update).encode() + b'\n')
+        
+        with patch.object(acp_client, 'parse_frame') as mock_parse:
+            assert await acp_client._read_frame(mock_reader, skip_updates=True) == []
+            mock_parse.assert_not_called()
+        assert await acp_client._read_frame(mock_reader) == [update]
+
+    @pytest.mark.asyncio
+    async def test_read_frame_timed_raises_timeout(self, monkeypatch):
+        """Test that a silent agent trips the per-frame read timeout."""
+        monkeypatch.setattr(acp_client, "AGENT_READ_TIMEOUT", 0.01)
+        with pytest.raises(asyncio.TimeoutError):
+            await acp_client._read_frame_timed(asyncio.StreamReader())
+
+    @pytest.mark.asyncio
+    async def test_drain_buffered_frames_stops_after_response(self):
+        """Test draining already-buffered frames in one pass."""
+        reader = asyncio.StreamReader()
+        frames = [
+            {"jsonrpc": "2.0", "method": "session/update", "params": {"update": {}}},
+            {"jsonrpc": "2.0", "id": 1, "result": {}},
+            {"jsonrpc": "2.0", "method": "later"},
+        ]
+        reader.feed_data(b"".join(json.dumps(f).encode() + b'\n' for f in frames) + b'{"partial')
+        
+        assert await acp_client._drain_buffered_frames(reader) == frames[:2]
+        # The frame after the response stays buffered for the next reader
+        assert await acp_client._drain_buffered_frames(reader) == frames[2:]
+        assert await acp_client._drain_buffered_frames(reader) == []
+
     @pytest.mark.asyncio
     async def test_send_request_not_connected(self):
         """Test send_request when not connected."""
@@ -80,18 +151,11 @@ class TestAcpClient:
             await acp_client._send_request("test", {})
 
     @pytest.mark.asyncio
-    async def test_send_request_success(self):
+    async def test_send_request_success(self, mock_writer, fake_reader):
         """Test successful request/response."""
-        mock_writer = AsyncMock()
-        mock_reader = AsyncMock()
-        
-        # Setup writer
-        mock_writer.write = MagicMock()
-        mock_writer.drain = AsyncMock()
-        
         # Setup reader to return matching response
         response = {"jsonrpc": "2.0", "id": 1, "result": {"message": "ok"}}
-        mock_reader.readline = AsyncMock(return_value=json.dumps(response).encode() + b'\n')
+        mock_reader = fake_reader([json.dumps(response).encode() + b'\n'])
         
         state = acp_client.get_state()
         state.agent_writer = mock_writer
@@ -101,25 +165,28 @@ class TestAcpClient:
         result = await acp_client._send_request("test/method", {"arg": "value"})
         
         assert result == {"message": "ok"}
-        mock_writer.write.assert_called_once()
+        mock_writer.writelines.assert_called_once()
         
         # Verify request format
-        written_data = mock_writer.write.call_args[0][0].decode()
+        written_data = b"".join(mock_writer.writelines.call_args[0][0]).decode()
         request = json.loads(written_data)
         assert request["method"] == "test/method"
         assert request["params"] == {"arg": "value"}
 
     @pytest.mark.asyncio
-    async def test_send_request_with_error(self):
-        """Test request that returns error."""
-        mock_writer = AsyncMock()
-        mock_reader = AsyncMock()
+    async def test_write_message_accepts_non_string_keys(self, mock_writer):
+        """Test that outgoing messages serialize like json.dumps did for int keys."""
+        acp_client.get_state().agent_writer = mock_writer
         
-        mock_writer.write = MagicMock()
-        mock_writer.drain = AsyncMock()
+        await acp_client._write_message({"params": {1: "a"}})
         
+        mock_writer.writelines.assert_called_once_with((b'{"params":{"1":"a"}}', b"\n"))
+
+    @pytest.mark.asyncio
+    async def test_send_request_with_error(self, mock_writer, fake_reader):
+        """Test request that returns error."""
         response = {"jsonrpc": "2.0", "id": 1, "error": {"code": -1, "message": "Failed"}}
-        mock_reader.readline = AsyncMock(return_value=json.dumps(response).encode() + b'\n')
+        mock_reader = fake_reader([json.dumps(response).encode() + b'\n'])
         
         state = acp_client.get_state()
         state.agent_writer = mock_writer
@@ -130,14 +197,8 @@ class TestAcpClient:
             await acp_client._send_request("test", {})
 
     @pytest.mark.asyncio
-    async def test_send_request_collects_updates(self):
+    async def test_send_request_collects_updates(self, mock_writer, fake_reader):
         """Test that session updates are collected."""
-        mock_writer = AsyncMock()
-        mock_reader = AsyncMock()
-        
-        mock_writer.write = MagicMock()
-        mock_writer.drain = AsyncMock()
-        
         # Return notification, then response
         notification = {
             "jsonrpc": "2.0",
@@ -177,7 +238,7 @@ class TestAcpClient:
             json.dumps(post_tool_notification).encode() + b'\n',
             json.dumps(response).encode() + b'\n'
         ]
-        mock_reader.readline = AsyncMock(side_effect=responses)
+        mock_reader = fake_reader(responses)
         
         state = acp_client.get_state()
         state.agent_writer = mock_writer
@@ -190,14 +251,8 @@ class TestAcpClient:
         assert result["_collected_text"] == "World"
 
     @pytest.mark.asyncio
-    async def test_send_request_collects_delta_chunks(self):
+    async def test_send_request_collects_delta_chunks(self, mock_writer, fake_reader):
         """Test that delta-style agent_message_chunk streams are accumulated."""
-        mock_writer = AsyncMock()
-        mock_reader = AsyncMock()
-
-        mock_writer.write = MagicMock()
-        mock_writer.drain = AsyncMock()
-
         notification_1 = {
             "jsonrpc": "2.0",
             "method": "session/update",
@@ -225,7 +280,7 @@ class TestAcpClient:
             json.dumps(notification_2).encode() + b'\n',
             json.dumps(response).encode() + b'\n',
         ]
-        mock_reader.readline = AsyncMock(side_effect=responses)
+        mock_reader = fake_reader(responses)
 
         state = acp_client.get_state()
         state.agent_writer = mock_writer
@@ -236,15 +291,27 @@ class TestAcpClient:
         assert result["_collected_text"] == "Hello World"
 
     @pytest.mark.asyncio
-    async def test_send_request_with_status_callback(self):
+    async def test_send_request_skips_result_dump_without_debug(self, mock_writer, fake_reader):
+        """Test that large results are not pretty-printed unless debug logging is on."""
+        response = {"jsonrpc": "2.0", "id": 1, "result": {"content": {"type": "image", "data": "A" * 4096}}}
+
+        state = acp_client.get_state()
+        state.agent_writer = mock_writer
+        state.agent_reader = fake_reader([json.dumps(response).encode() + b'\n'])
+        state.request_id = 0
+
+        with patch.object(acp_client.logger, "isEnabledFor", return_value=False), \
+                patch.object(acp_client.json, "dumps") as mock_dumps:
+            result = await acp_client._send_request("test", {}, collect_updates=True)
+
+        mock_dumps.assert_not_called()
+        assert result["_collected_content"][0]["type"] == "image"
+
+    @pytest.mark.asyncio
+    async def test_send_request_with_status_callback(self, mock_writer, fake_reader):
         """Test that status callback is called for tool_call updates."""
-        mock_writer = AsyncMock()
-        mock_reader = AsyncMock()
         mock_callback = AsyncMock()
-        
-        mock_writer.write = MagicMock()
-        mock_writer.drain = AsyncMock()
-        
+
         notification = {
             "jsonrpc": "2.0",
             "method": "session/update",
@@ -261,7 +328,7 @@ class TestAcpClient:
             json.dumps(notification).encode() + b'\n',
             json.dumps(response).encode() + b'\n'
         ]
-        mock_reader.readline = AsyncMock(side_effect=responses)
+        mock_reader = fake_reader(responses)
         
         state = acp_client.get_state()
         state.agent_writer = mock_writer
@@ -273,17 +340,13 @@ class TestAcpClient:
         mock_callback.assert_called_once_with({"type": "tool_call", "title": "Running tests..."})
 
     @pytest.mark.asyncio
-    async def test_stop_agent(self):
+    async def test_stop_agent(self, mock_writer):
         """Test stopping the agent."""
         mock_proc = AsyncMock()
         mock_proc.terminate = MagicMock()
         mock_proc.wait = AsyncMock()
         mock_proc.returncode = None
         
-        mock_writer = MagicMock()
-        mock_writer.write = MagicMock()
-        mock_writer.drain = AsyncMock()
-        
         state = acp_client.get_state()
         state.agent_proc = mock_proc
         state.agent_reader = MagicMock()
@@ -293,8 +356,8 @@ class TestAcpClient:
         await acp_client.stop_agent()
         
         # Should have sent session/cancel notification
-        mock_writer.write.assert_called()
-        written = mock_writer.write.call_args[0][0].decode()
+        mock_writer.writelines.assert_called()
+        written = b"".join(mock_writer.writelines.call_args[0][0]).decode()
         assert "session/cancel" in written
         assert "test-session" in written
         
@@ -304,12 +367,8 @@ class TestAcpClient:
         assert state.session_id is None
 
     @pytest.mark.asyncio
-    async def test_cancel_session(self):
+    async def test_cancel_session(self, mock_writer):
         """Test cancel_session sends notification without stopping agent."""
-        mock_writer = MagicMock()
-        mock_writer.write = MagicMock()
-        mock_writer.drain = AsyncMock()
-        
         state = acp_client.get_state()
         state.agent_writer = mock_writer
         state.session_id = "test-session"
@@ -318,8 +377,8 @@ class TestAcpClient:
         result = await acp_client.cancel_session()
         
         assert result is True
-        mock_writer.write.assert_called()
-        written = mock_writer.write.call_args[0][0].decode()
+        mock_writer.writelines.assert_called()
+        written = b"".join(mock_writer.writelines.call_args[0][0]).decode()
         assert "session/cancel" in written
         # Agent proc should still be set
         assert state.agent_proc is not None
@@ -417,63 +476,29 @@ class TestAcpClient:
 class TestContentParsing:
     """Test content block parsing functions."""
 
-    def test_parse_text_block(self):
-        """Test parsing text content block."""
-        block = {"type": "text", "text": "Hello world"}
-        result = acp_client._parse_content_block(block)
-        assert result == {"type": "text", "text": "Hello world"}
-
-    def test_parse_image_block_base64(self):
-        """Test parsing image block with base64 data."""
-        block = {
-            "type": "image",
-            "content": "iVBORw0KGgo=",
-            "content_encoding": "base64",
-            "content_type": "image/png"
-        }
-        result = acp_client._parse_content_block(block)
-        assert result["type"] == "image"
-        assert result["data"] == "iVBORw0KGgo="
-        assert result["encoding"] == "base64"
-        assert result["mime_type"] == "image/png"
-
-    def test_parse_image_block_url(self):
-        """Test parsing image block with URL."""
-        block = {
-            "type": "image",
-            "content_url": "https://example.com/image.png",
-            "content_type": "image/png"
-        }
-        result = acp_client._parse_content_block(block)
-        assert result["type"] == "image"
-        assert result["url"] == "https://example.com/image.png"
-        assert result["mime_type"] == "image/png"
-
-    def test_parse_file_block(self):
-        """Test parsing file/artifact block."""
-        block = {
-            "type": "file",
-            "name": "data.json",
-            "content": "eyJrZXkiOiAidmFsdWUifQ==",
-            "content_encoding": "base64",
-            "content_type": "application/json"
-        }
-        result = acp_client._parse_content_block(block)
-        assert result["type"] == "file"
-        assert result["name"] == "data.json"
-        assert result["mime_type"] == "application/json"
-
-    def test_parse_unknown_block(self):
-        """Test parsing unknown block type preserves it."""
-        block = {"type": "custom", "data": "something"}
-        result = acp_client._parse_content_block(block)
-        assert result == block
-
-    def test_parse_empty_block(self):
-        """Test parsing block without type returns None."""
-        block = {"data": "no type"}
-        result = acp_client._parse_content_block(block)
-        assert result is None
+    @pytest.mark.parametrize("block,expected", [
+        ({"type": "text", "text": "Hello world"}, {"type": "text", "text": "Hello world"}),
+        (
+            {"type": "image", "content": "iVBORw0KGgo=", "content_encoding": "base64", "content_type": "image/png"},
+            {"type": "image", "data": "iVBORw0KGgo=", "encoding": "base64", "mime_type": "image/png"},
+        ),
+        (
+            {"type": "image", "content_url": "https://example.com/image.png", "content_type": "image/png"},
+            {"type": "image", "url": "https://example.com/image.png", "mime_type": "image/png"},
+        ),
+        (
+            {"type": "file", "name": "data.json", "content": "eyJrZXkiOiAidmFsdWUifQ==",
+             "content_encoding": "base64", "content_type": "application/json"},
+            {"type": "file", "name": "data.json", "mime_type": "application/json",
+             "data": "eyJrZXkiOiAidmFsdWUifQ==", "encoding": "base64"},
+        ),
+        ({"type": "custom", "data": "something"}, {"type": "custom", "data": "something"}),
+        ({"data": "no type"}, None),
+        ("not a block", None),
+    ], ids=["text", "image-base64", "image-url", "file", "unknown", "untyped", "non-dict"])
+    def test_parse_content_block(self, block, expected):
+        """Test parsing each content block type into the internal format."""
+        assert acp_client._parse_content_block(block) == expected
 
     def test_collect_content_blocks_dict(self):
         """Test collecting content from dict."""
@@ -495,6 +520,18 @@ class TestContentParsing:
         assert collected[0]["type"] == "text"
         assert collected[1]["type"] == "image"
 
+    def test_collect_content_blocks_nested_keeps_order(self):
+        """Test that wrapped and nested content is flattened in document order."""
+        content = [
+            {"type": "content", "content": {"type": "text", "text": "a"}},
+            {"content": [{"type": "text", "text": "b"}, ["ignored"], {"type": "text", "text": "c"}]},
+            "ignored",
+            {"type": "text", "text": "d"},
+        ]
+        collected = []
+        acp_client._collect_content_blocks(content, collected)
+        assert [b["text"] for b in collected] == ["a", "b", "c", "d"]
+
     @pytest.mark.asyncio
     async def test_send_message_multimodal_success(self):
         """Test send_message_multimodal returns structured response."""
@@ -528,16 +565,10 @@ class TestContentParsing:
             acp_client.get_state().request_lock.release()
 
     @pytest.mark.asyncio
-    async def test_permission_request_timeout_cancels_and_stops_agent(self, monkeypatch):
+    async def test_permission_request_timeout_cancels_and_stops_agent(self, mock_writer, fake_reader, monkeypatch):
         """If user doesn't respond to permission, we cancel and stop the agent (fast timeout in tests)."""
         from types import SimpleNamespace
 
-        mock_writer = AsyncMock()
-        mock_reader = AsyncMock()
-
-        mock_writer.write = MagicMock()
-        mock_writer.drain = AsyncMock()
-
         permission_request = {
             "jsonrpc": "2.0",
             "id": 999,
@@ -556,7 +587,7 @@ class TestContentParsing:
             json.dumps(permission_request).encode() + b"\n",
             json.dumps(final_response).encode() + b"\n",
         ]
-        mock_reader.readline = AsyncMock(side_effect=responses)
+        mock_reader = fake_reader(responses)
 
         monkeypatch.setattr(
             acp_client,
@@ -1,45 +1,33 @@
 """Tests for ACP protocol module."""
 
+from unittest.mock import patch
+
+import pytest
+
 from vibes import acp_protocol
 
 
 class TestFrameClassification:
     """Test JSON-RPC frame classification."""
 
-    def test_notification_no_id_with_method(self):
-        msg = {"jsonrpc": "2.0", "method": "session/update", "params": {}}
-        assert acp_protocol.classify_frame(msg) == "notification"
-        assert acp_protocol.is_notification(msg) is True
-        assert acp_protocol.is_request(msg) is False
-        assert acp_protocol.is_response(msg) is False
-
-    def test_request_has_id_and_method(self):
-        msg = {"jsonrpc": "2.0", "id": 1, "method": "session/request_permission", "params": {}}
-        assert acp_protocol.classify_frame(msg) == "request"
-        assert acp_protocol.is_request(msg) is True
-        assert acp_protocol.is_notification(msg) is False
-        assert acp_protocol.is_response(msg) is False
-
-    def test_response_has_id_and_result(self):
-        msg = {"jsonrpc": "2.0", "id": 1, "result": {"sessionId": "abc"}}
-        assert acp_protocol.classify_frame(msg) == "response"
-        assert acp_protocol.is_response(msg) is True
-        assert acp_protocol.is_request(msg) is False
-        assert acp_protocol.is_notification(msg) is False
-
-    def test_response_has_id_and_error(self):
-        msg = {"jsonrpc": "2.0", "id": 1, "error": {"code": -1, "message": "fail"}}
-        assert acp_protocol.classify_frame(msg) == "response"
-        assert acp_protocol.is_response(msg) is True
-
-    def test_invalid_no_method_no_result(self):
-        msg = {"jsonrpc": "2.0", "id": 1}
-        assert acp_protocol.classify_frame(msg) == "invalid"
-
-    def test_invalid_non_dict(self):
-        assert acp_protocol.classify_frame("not a dict") == "invalid"
-        assert acp_protocol.classify_frame(123) == "invalid"
-        assert acp_protocol.classify_frame(None) == "invalid"
+    @pytest.mark.parametrize("msg,expected", [
+        ({"jsonrpc": "2.0", "method": "session/update", "params": {}}, "notification"),
+        ({"jsonrpc": "2.0", "id": 1, "method": "session/request_permission", "params": {}}, "request"),
+        ({"jsonrpc": "2.0", "id": 1, "result": {"sessionId": "abc"}}, "response"),
+        ({"jsonrpc": "2.0", "id": 1, "error": {"code": -1, "message": "fail"}}, "response"),
+        ({"jsonrpc": "2.0", "id": 1}, "invalid"),
+        ({"jsonrpc": "2.0", "method": "x", "result": {}}, "notification"),
+        ({"jsonrpc": "2.0", "id": 1, "method": "x", "error": {}}, "request"),
+        ({"jsonrpc": "2.0", "result": {}}, "invalid"),
+        ("not a dict", "invalid"),
+        (123, "invalid"),
+        (None, "invalid"),
+    ])
+    def test_classify_frame(self, msg, expected):
+        assert acp_protocol.classify_frame(msg) == expected
+        assert acp_protocol.is_notification(msg) is (expected == "notification")
+        assert acp_protocol.is_request(msg) is (expected == "request")
+        assert acp_protocol.is_response(msg) is (expected == "response")
 
 
 class TestParseFrame:
@@ -75,12 +63,33 @@ class TestParseFrame:
         result = acp_protocol.parse_frame(line)
         assert result == []
 
+    def test_non_frame_line_skips_json_parse(self):
+        with patch.object(acp_protocol.orjson, "loads") as loads:
+            assert acp_protocol.parse_frame(b"Starting agent...\n") == []
+            assert acp_protocol.parse_frame(b"42\n") == []
+        loads.assert_not_called()
+
     def test_non_utf8_returns_empty(self):
         line = b'\x80\x81\x82\n'
         result = acp_protocol.parse_frame(line)
         assert result == []
 
 
+class TestPeekMethod:
+    """Test cheap method sniffing on raw lines."""
+
+    def test_top_level_method(self):
+        line = b'{"jsonrpc":"2.0","method":"session/update","params":{"update":{}}}\n'
+        assert acp_protocol.peek_method(line) == "session/update"
+
+    def test_nested_method_ignored(self):
+        line = b'{"jsonrpc":"2.0","id":1,"result":{"method":"session/update"}}\n'
+        assert acp_protocol.peek_method(line) is None
+
+    def test_batch_not_peeked(self):
+        assert acp_protocol.peek_method(b'[{"method":"session/update"}]\n') is None
+
+
 class TestToolCallState:
     """Test tool call state management."""
 
@@ -120,6 +129,20 @@ class TestToolCallState:
         assert tc.kind == "read"
         assert tc.raw_output == {"result": "ok"}
 
+    def test_merge_update_maps_all_acp_fields(self):
+        tc = acp_protocol.ToolCallState(tool_call_id="tc-1")
+        tc.merge_update({
+            "toolCallId": "ignored",
+            "rawInput": {"command": "ls"},
+            "content": [{"type": "text", "text": "out"}],
+            "locations": [{"path": "/tmp"}],
+        })
+        assert tc.tool_call_id == "tc-1"
+        assert tc.raw_input == {"command": "ls"}
+        assert tc.content == [{"type": "text", "text": "out"}]
+        assert tc.locations == [{"path": "/tmp"}]
+        assert not hasattr(tc, "__dict__")
+
 
 class TestTurnState:
     """Test per-turn aggregation state."""
@@ -163,6 +186,16 @@ class TestTurnState:
         assert len(turn.pre_tool_blocks) == 1
         assert len(turn.post_tool_blocks) == 1
 
+    def test_add_message_chunk_collapses_snapshots_keeps_deltas(self):
+        turn = acp_protocol.TurnState(turn_id=1)
+
+        turn.add_message_chunk({"type": "text", "text": "Hel"})
+        turn.add_message_chunk({"type": "text", "text": "Hello"})
+        assert turn.pre_tool_blocks == [{"type": "text", "text": "Hello"}]
+
+        turn.add_message_chunk({"type": "text", "text": " world"})
+        assert [b["text"] for b in turn.pre_tool_blocks] == ["Hello", " world"]
+
     def test_get_final_blocks_returns_post_if_tool_seen(self):
         turn = acp_protocol.TurnState(turn_id=1)
         turn.pre_tool_blocks.append({"type": "text", "text": "pre"})
@@ -221,6 +254,16 @@ class TestSegmentKindClassification:
         assert acp_protocol.segment_kind_from_annotations(None) is None
         assert acp_protocol.segment_kind_from_annotations([]) is None
 
+    def test_segment_kind_from_annotations_first_match_wins(self):
+        ann = ["noise", {"type": "other"}, {"type": "intent"}, {"kind": "thought"}]
+        assert acp_protocol.segment_kind_from_annotations(ann) == "intent"
+        assert acp_protocol.segment_kind_from_annotations("thinking") is None
+
+    def test_get_block_segment_kind_ignores_update(self):
+        assert acp_protocol.get_block_segment_kind({"channel": "Thought"}) == "thought"
+        assert acp_protocol.get_block_segment_kind({"annotations": [{"type": "intent"}]}) == "intent"
+        assert acp_protocol.get_block_segment_kind({"type": "text", "text": "hi"}) is None
+
     def test_is_thinking_content_with_update_hint(self):
         update = {"segment": "thinking"}
         assert acp_protocol.is_thinking_content(update) is True
@@ -1,62 +1,69 @@
 """Tests for route handlers."""
 
-import pytest
+import asyncio
 import io
+from collections import deque
+from types import SimpleNamespace
+from unittest.mock import AsyncMock, patch
+
+import orjson
+import pytest
+from aiohttp import FormData, web
+from aiohttp.test_utils import TestClient, TestServer
+from PIL import Image
 
-from vibes.routes import media
+from vibes import acp_client
+from vibes.routes import agents, media, sse
 
 
 class TestGenerateThumbnail:
     """Test thumbnail generation."""
 
     def test_generate_thumbnail_non_image(self):
-        """Test thumbnail generation for non-image returns None."""
-        result = media.generate_thumbnail(b'text data', 'text/plain')
+        """Test thumbnail generation for non-image returns None without decoding."""
+        with patch.object(media.Image, 'open') as mock_open:
+            result = media.generate_thumbnail(b'text data', 'text/plain')
         assert result is None
+        mock_open.assert_not_called()
 
     def test_generate_thumbnail_invalid_image(self):
         """Test thumbnail generation for invalid image returns None."""
         result = media.generate_thumbnail(b'not an image', 'image/png')
         assert result is None
 
-    def test_generate_thumbnail_valid_image(self):
-        """Test thumbnail generation for valid image."""
-        from PIL import Image
-        img = Image.new('RGB', (100, 100), color='red')
-        buf = io.BytesIO()
-        img.save(buf, format='PNG')
-        
-        result = media.generate_thumbnail(buf.getvalue(), 'image/png')
+    @pytest.mark.parametrize("mode,size,color,expected_size", [
+        ('RGB', (100, 100), 'red', (100, 100)),
+        ('P', (2000, 2000), 'blue', (media.MAX_THUMBNAIL_SIZE, media.MAX_THUMBNAIL_SIZE)),
+        ('RGBA', (100, 100), (255, 0, 0, 128), (100, 100)),
+    ])
+    def test_generate_thumbnail_valid_image(self, png_bytes, mode, size, color, expected_size):
+        """Test that valid images become RGB thumbnails no larger than the limit."""
+        result = media.generate_thumbnail(png_bytes(mode, size, color), 'image/png')
         assert result is not None
-        assert len(result) > 0
+        assert len(result) < 20_000
 
-    def test_generate_thumbnail_large_image_resized(self):
-        """Test that large images are resized."""
-        from PIL import Image
-        img = Image.new('RGB', (2000, 2000), color='blue')
-        buf = io.BytesIO()
-        img.save(buf, format='PNG')
-        
-        result = media.generate_thumbnail(buf.getvalue(), 'image/png')
-        assert result is not None
-        
         result_img = Image.open(io.BytesIO(result))
-        assert max(result_img.size) <= media.MAX_THUMBNAIL_SIZE
+        assert result_img.mode == 'RGB'
+        assert result_img.size == expected_size
 
-    def test_generate_thumbnail_rgba_converted(self):
-        """Test that RGBA images are converted to RGB."""
-        from PIL import Image
-        img = Image.new('RGBA', (100, 100), color=(255, 0, 0, 128))
+    def test_generate_thumbnail_and_meta_returns_dimensions(self, png_bytes):
+        """Test that original dimensions come back with the thumbnail."""
+        thumbnail, meta = media.generate_thumbnail_and_meta(png_bytes('RGB', (640, 480), 'red'), 'image/png')
+        assert thumbnail is not None
+        assert meta == {"width": 640, "height": 480}
+        assert media.generate_thumbnail_and_meta(b'text data', 'text/plain') == (None, {})
+
+    def test_generate_thumbnail_large_jpeg_keeps_original_meta(self):
+        """Test that draft-mode JPEG decoding still reports the original size."""
         buf = io.BytesIO()
-        img.save(buf, format='PNG')
-        
-        result = media.generate_thumbnail(buf.getvalue(), 'image/png')
-        assert result is not None
+        Image.new('RGB', (3200, 1600), color='blue').save(buf, format='JPEG')
         
-        result_img = Image.open(io.BytesIO(result))
-        assert result_img.mode == 'RGB'
+        thumbnail, meta = media.generate_thumbnail_and_meta(buf.getvalue(), 'image/jpeg')
+        assert meta == {"width": 3200, "height": 1600}
+        assert Image.open(io.BytesIO(thumbnail)).size == (media.MAX_THUMBNAIL_SIZE, media.MAX_THUMBNAIL_SIZE // 2)
 
 
+@pytest.mark.integration
 class TestPostRoutesIntegration:
     """Integration tests for post routes."""
 
@@ -67,34 +74,40 @@ class TestPostRoutesIntegration:
         # Create post
         resp = await client.post('/post', json={'content': 'Test post'})
         assert resp.status == 201
-        data = await resp.json()
+        data = await resp.json(loads=orjson.loads)
         assert data['data']['content'] == 'Test post'
         
         # Get timeline
         resp = await client.get('/timeline')
         assert resp.status == 200
-        timeline = await resp.json()
+        timeline = await resp.json(loads=orjson.loads)
         assert len(timeline['posts']) == 1
 
     @pytest.mark.asyncio
-    async def test_timeline_pagination(self, posts_test_client):
+    async def test_create_post_invalid_json(self, posts_test_client):
+        """Test that malformed bodies are rejected."""
+        resp = await posts_test_client.post('/post', data=b'not json')
+        assert resp.status == 400
+        assert (await resp.json(loads=orjson.loads))['error'] == 'Invalid JSON'
+
+    @pytest.mark.asyncio
+    async def test_timeline_pagination(self, posts_test_client, seed_posts):
         """Test timeline pagination."""
         client = posts_test_client
-        # Create 10 posts
-        for i in range(10):
-            await client.post('/post', json={'content': f'Post {i}'})
+        await seed_posts(10)
         
         # Get first page
         resp = await client.get('/timeline?limit=5')
-        data = await resp.json()
+        data = await resp.json(loads=orjson.loads)
         assert len(data['posts']) == 5
         assert data['has_more'] is True
         
         # Get second page
         before_id = data['posts'][0]['id']
         resp = await client.get(f'/timeline?limit=5&before={before_id}')
-        data2 = await resp.json()
+        data2 = await resp.json(loads=orjson.loads)
         assert len(data2['posts']) == 5
+        assert data2['has_more'] is False
 
     @pytest.mark.asyncio
     async def test_thread_operations(self, posts_test_client):
@@ -102,7 +115,7 @@ class TestPostRoutesIntegration:
         client = posts_test_client
         # Create parent post
         resp = await client.post('/post', json={'content': 'Parent'})
-        parent = await resp.json()
+        parent = await resp.json(loads=orjson.loads)
         
         # Create reply
         resp = await client.post('/reply', json={
@@ -114,20 +127,36 @@ class TestPostRoutesIntegration:
         # Get thread
         resp = await client.get(f"/thread/{parent['id']}")
         assert resp.status == 200
-        thread = await resp.json()
+        thread = await resp.json(loads=orjson.loads)
         assert len(thread['thread']) == 2
 
     @pytest.mark.asyncio
     async def test_hashtag_search(self, posts_test_client):
         """Test hashtag search."""
         client = posts_test_client
-        await client.post('/post', json={'content': 'Hello #python'})
         await client.post('/post', json={'content': 'Hello #javascript'})
+        for i in range(3):
+            await client.post('/post', json={'content': f'Hello {i} #python'})
         
-        resp = await client.get('/hashtag/python')
+        resp = await client.get('/hashtag/python?limit=2')
         assert resp.status == 200
-        data = await resp.json()
-        assert len(data['posts']) == 1
+        data = await resp.json(loads=orjson.loads)
+        assert len(data['posts']) == 2
+        assert data['has_more'] is True
+        
+        # The short final page ends pagination instead of handing out another cursor
+        resp = await client.get(f"/hashtag/python?limit=2&before={data['next_cursor']}")
+        data = await resp.json(loads=orjson.loads)
+        assert [p['data']['content'] for p in data['posts']] == ['Hello 0 #python']
+        assert data['has_more'] is False
+        assert data['next_cursor'] is None
+
+    @pytest.mark.asyncio
+    async def test_hashtag_invalid_cursor(self, posts_test_client):
+        """Test that a non-numeric cursor is a client error, not a 500."""
+        resp = await posts_test_client.get('/hashtag/python?before=abc')
+        assert resp.status == 400
+        assert (await resp.json(loads=orjson.loads))['error'] == "Invalid 'before' parameter"
 
 
 class TestSSEDisconnectRestart:
@@ -135,14 +164,9 @@ class TestSSEDisconnectRestart:
 
     @pytest.mark.asyncio
     async def test_agent_restart_scheduled_when_last_client_disconnects(self, monkeypatch):
-        from aiohttp import web
-        from aiohttp.test_utils import TestClient, TestServer
-        from unittest.mock import AsyncMock
-        from vibes.routes import sse
-
         monkeypatch.setattr(sse, "stop_agent", AsyncMock())
         monkeypatch.setattr(sse, "start_agent", AsyncMock())
-        monkeypatch.setattr(sse, "get_config", lambda: type("C", (), {"agent_restart_on_disconnect_s": 0})())
+        monkeypatch.setattr(sse, "get_config", lambda: type("C", (), {"disconnect_timeout": 0})())
 
         app = web.Application()
         sse.setup_routes(app)
@@ -155,19 +179,241 @@ class TestSSEDisconnectRestart:
         assert sse.stop_agent.await_count == 0
         assert sse.start_agent.await_count == 0
 
+    @pytest.mark.asyncio
+    async def test_agent_restarted_once_after_disconnect_timeout(self, monkeypatch):
+        monkeypatch.setattr(sse, "stop_agent", AsyncMock())
+        monkeypatch.setattr(sse, "start_agent", AsyncMock())
+        monkeypatch.setattr(sse, "get_config", lambda: type("C", (), {"disconnect_timeout": 0.01})())
+
+        app = web.Application()
+        sse.setup_routes(app)
+
+        async with TestClient(TestServer(app)) as client:
+            resp = await client.get('/sse/stream')
+            await resp.content.readuntil(b"\n\n")
+            resp.close()
+            for _ in range(100):
+                if sse.start_agent.await_count:
+                    break
+                await asyncio.sleep(0.01)
+            # Staying idle doesn't trigger further restarts
+            await asyncio.sleep(0.05)
+
+        assert sse.stop_agent.await_count == 1
+        assert sse.start_agent.await_count == 1
+
+
+class TestSSEBroadcast:
+    """Broadcast fan-out to connected SSE clients."""
+
+    @pytest.mark.asyncio
+    async def test_connected_client_receives_broadcasts(self, monkeypatch):
+        monkeypatch.setattr(sse, "get_config", lambda: SimpleNamespace(disconnect_timeout=0))
+
+        app = web.Application()
+        sse.setup_routes(app)
+
+        async with TestClient(TestServer(app)) as client:
+            resp = await client.get('/sse/stream')
+            assert await resp.content.readuntil(b"\n\n") == b"event: connected\ndata: {}\n\n"
+
+            await sse.broadcast_event("new_post", {"id": 1})
+            # Pre-encoded JSON is sent without re-serializing
+            await sse.broadcast_event("new_post", b'{"id":2}')
+
+            received = b""
+            while received.count(b"\n\n") < 2:
+                received += await asyncio.wait_for(resp.content.readuntil(b"\n\n"), timeout=1)
+            assert received == (
+                b'event: new_post\ndata: {"id":1}\n\n'
+                b'event: new_post\ndata: {"id":2}\n\n'
+            )
+            resp.close()
+
+    @pytest.mark.asyncio
+    async def test_ring_drops_frames_read_by_every_client(self, monkeypatch):
+        monkeypatch.setattr(sse, "get_config", lambda: SimpleNamespace(disconnect_timeout=0))
+
+        app = web.Application()
+        sse.setup_routes(app)
+
+        async with TestClient(TestServer(app)) as client:
+            streams = [await client.get('/sse/stream') for _ in range(2)]
+            for resp in streams:
+                await resp.content.readuntil(b"\n\n")
+
+            await sse.broadcast_event("new_post", {"id": 1})
+            for resp in streams:
+                frame = await asyncio.wait_for(resp.content.readuntil(b"\n\n"), timeout=1)
+                assert frame == b'event: new_post\ndata: {"id":1}\n\n'
+            assert len(sse._buf) == 0
+            for resp in streams:
+                resp.close()
 
+    @pytest.mark.asyncio
+    async def test_lagging_client_gets_resync(self, monkeypatch):
+        monkeypatch.setattr(sse, "get_config", lambda: SimpleNamespace(disconnect_timeout=0))
+        monkeypatch.setattr(sse, "_buf", deque(maxlen=2))
+
+        app = web.Application()
+        sse.setup_routes(app)
+
+        async with TestClient(TestServer(app)) as client:
+            resp = await client.get('/sse/stream')
+            await resp.content.readuntil(b"\n\n")
+
+            # Three frames land before the client runs; the ring only holds two
+            for i in range(3):
+                await sse.broadcast_event("new_post", {"id": i})
+
+            received = b""
+            while received.count(b"\n\n") < 3:
+                received += await asyncio.wait_for(resp.content.readuntil(b"\n\n"), timeout=1)
+            assert received == (
+                sse.RESYNC_FRAME +
+                b'event: new_post\ndata: {"id":1}\n\n'
+                b'event: new_post\ndata: {"id":2}\n\n'
+            )
+            resp.close()
+
+    @pytest.mark.asyncio
+    async def test_idle_client_gets_heartbeats(self, monkeypatch):
+        monkeypatch.setattr(sse, "get_config", lambda: SimpleNamespace(disconnect_timeout=0))
+        monkeypatch.setattr(sse, "HEARTBEAT_INTERVAL", 0.01)
+
+        app = web.Application()
+        sse.setup_routes(app)
+
+        async with TestClient(TestServer(app)) as client:
+            resp = await client.get('/sse/stream')
+            await resp.content.readuntil(b"\n\n")
+            for _ in range(2):
+                frame = await asyncio.wait_for(resp.content.readuntil(b"\n\n"), timeout=1)
+                assert frame == b": heartbeat\n\n"
+
+            # A broadcast still gets through after idle heartbeats
+            await sse.broadcast_event("new_post", {"id": 3})
+            frame = b": heartbeat\n\n"
+            while frame == b": heartbeat\n\n":
+                frame = await asyncio.wait_for(resp.content.readuntil(b"\n\n"), timeout=1)
+            assert frame == b'event: new_post\ndata: {"id":3}\n\n'
+            resp.close()
+
+
+class TestAgentCallbackWiring:
+    """ACP callbacks are registered by setup_routes, not on import."""
+
+    def test_setup_routes_registers_callbacks(self):
+        acp_client.reset_state()
+        assert acp_client.get_state().request_callback is None
+
+        agents.setup_routes(web.Application())
+        state = acp_client.get_state()
+        assert state.request_callback is agents._handle_agent_request
+        assert state.whitelist_checker is agents._check_whitelist
+        acp_client.reset_state()
+
+
+class TestDraftCoalescing:
+    """Agent draft chunks are merged before broadcast."""
+
+    @pytest.mark.asyncio
+    async def test_chunks_coalesced_until_flush(self):
+        with patch.object(agents, "broadcast_event", new_callable=AsyncMock) as mock_broadcast:
+            drafts = agents._DraftCoalescer(thread_id=1, agent_id="default")
+            await drafts.add("Hello ", "draft", "append")
+            await drafts.add("World", "draft", "append")
+            mock_broadcast.assert_not_called()
+
+            await drafts.flush()
+            mock_broadcast.assert_awaited_once()
+            event, payload = mock_broadcast.call_args[0]
+            assert event == "agent_draft"
+            assert payload["text"] == "Hello World"
+            assert payload["mode"] == "append"
+
+    @pytest.mark.asyncio
+    async def test_replace_supersedes_pending_and_timer_flushes(self):
+        with patch.object(agents, "broadcast_event", new_callable=AsyncMock) as mock_broadcast:
+            drafts = agents._DraftCoalescer(thread_id=1, agent_id="default")
+            await drafts.add("stale", "draft", "append")
+            await drafts.add("Fresh snapshot", "draft", "replace")
+            await asyncio.sleep(agents.DRAFT_FLUSH_INTERVAL * 2)
+
+            mock_broadcast.assert_awaited_once()
+            payload = mock_broadcast.call_args[0][1]
+            assert payload["text"] == "Fresh snapshot"
+            assert payload["mode"] == "replace"
+
+
+@pytest.mark.integration
 class TestMediaRoutesIntegration:
     """Integration tests for media routes."""
 
     @pytest.mark.asyncio
-    async def test_media_not_found(self, media_test_client):
-        """Test getting non-existent media."""
+    async def test_duplicate_upload_reuses_media(self, media_test_client, png_bytes):
+        """Test that uploading identical bytes under the same name returns the existing media."""
         client = media_test_client
-        resp = await client.get('/media/99999')
-        assert resp.status == 404
+        image = png_bytes('RGB', (50, 50), 'green')
+        
+        uploads = []
+        for name in ('a.png', 'a.png', 'b.png'):
+            form = FormData()
+            form.add_field('file', image, filename=name, content_type='image/png')
+            resp = await client.post('/media/upload', data=form)
+            assert resp.status == 201
+            uploads.append(await resp.json(loads=orjson.loads))
         
-        resp = await client.get('/media/99999/thumbnail')
-        assert resp.status == 404
+        assert uploads[0]['id'] == uploads[1]['id']
+        resp = await client.get(f"/media/{uploads[0]['id']}/thumbnail")
+        assert resp.status == 200
         
-        resp = await client.get('/media/99999/info')
-        assert resp.status == 404
+        # Same bytes under another name keep their own filename
+        assert uploads[2]['id'] != uploads[0]['id']
+        assert uploads[2]['filename'] == 'b.png'
+
+    @pytest.mark.asyncio
+    async def test_media_etag_not_modified(self, media_test_client):
+        """Test that media responses are cacheable and honor If-None-Match."""
+        client = media_test_client
+        form = FormData()
+        form.add_field('file', b'plain text', filename='a.txt', content_type='text/plain')
+        resp = await client.post('/media/upload', data=form)
+        media_id = (await resp.json(loads=orjson.loads))['id']
+        
+        resp = await client.get(f'/media/{media_id}')
+        assert resp.status == 200
+        assert resp.content_type == 'text/plain'
+        assert await resp.read() == b'plain text'
+        assert 'immutable' in resp.headers['Cache-Control']
+        etag = resp.headers['ETag']
+        
+        resp = await client.get(f'/media/{media_id}', headers={'If-None-Match': etag})
+        assert resp.status == 304
+        
+        # Media without a thumbnail falls back to the streamed original
+        resp = await client.get(f'/media/{media_id}/thumbnail')
+        assert resp.status == 200
+        assert await resp.read() == b'plain text'
+
+    @pytest.mark.asyncio
+    async def test_upload_rejects_oversize_content_length(self, media_test_client, monkeypatch):
+        """Test that oversize bodies are rejected but a file at the limit fits despite multipart overhead."""
+        monkeypatch.setattr(media, "MAX_UPLOAD_SIZE", 1024)
+        monkeypatch.setattr(media, "MULTIPART_OVERHEAD", 512)
+        for size, status in ((1024, 201), (2048, 413)):
+            form = FormData()
+            form.add_field('file', b'x' * size, filename='big.bin', content_type='application/octet-stream')
+            resp = await media_test_client.post('/media/upload', data=form)
+            assert resp.status == status
+
+    @pytest.mark.asyncio
+    async def test_media_not_found(self, media_test_client):
+        """Test getting non-existent media."""
+        client = media_test_client
+        responses = await asyncio.gather(
+            client.get('/media/99999'),
+            client.get('/media/99999/thumbnail'),
+            client.get('/media/99999/info'),
+        )
+        assert [resp.status for resp in responses] == [404, 404, 404]
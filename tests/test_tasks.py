@@ -0,0 +1,75 @@
+"""Tests for the background task queue."""
+
+import asyncio
+import threading
+
+import pytest
+import pytest_asyncio
+
+from vibes import tasks
+
+
+@pytest_asyncio.fixture
+async def task_queue():
+    """Run a single-worker task queue for the duration of a test."""
+    await tasks.start_task_queue(num_workers=1)
+    try:
+        yield
+    finally:
+        await tasks.stop_task_queue()
+
+
+class TestTaskQueue:
+    """Test task execution and shutdown."""
+
+    @pytest.mark.asyncio
+    async def test_plain_function_runs_off_loop(self, task_queue):
+        """Test that non-async task functions run in a worker thread."""
+        ran = asyncio.Event()
+        threads = []
+        loop = asyncio.get_running_loop()
+
+        def job(value):
+            threads.append((threading.current_thread(), value))
+            loop.call_soon_threadsafe(ran.set)
+
+        assert tasks.enqueue(job, 42)
+        await asyncio.wait_for(ran.wait(), timeout=1)
+        thread, value = threads[0]
+        assert value == 42
+        assert thread is not threading.main_thread()
+        assert thread.name.startswith("vibes-task")
+
+    @pytest.mark.asyncio
+    async def test_failing_task_does_not_kill_worker(self, task_queue):
+        """Test that the worker keeps processing after a task raises."""
+        done = asyncio.Event()
+
+        async def broken():
+            raise RuntimeError("boom")
+
+        async def ok():
+            done.set()
+
+        tasks.enqueue(broken)
+        tasks.enqueue(ok)
+        await asyncio.wait_for(done.wait(), timeout=1)
+        assert not tasks._workers[0].done()
+
+    @pytest.mark.asyncio
+    async def test_stop_drains_pending_tasks(self):
+        """Test that stopping runs already-queued tasks before workers exit."""
+        await tasks.start_task_queue(num_workers=2)
+        finished = []
+
+        async def job(i):
+            await asyncio.sleep(0.01)
+            finished.append(i)
+
+        for i in range(5):
+            tasks.enqueue(job, i)
+        await tasks.stop_task_queue()
+
+        assert sorted(finished) == list(range(5))
+        assert tasks._workers == []
+        assert tasks.enqueue(job, 99) is False